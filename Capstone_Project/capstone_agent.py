@@ -11,16 +11,109 @@ import os
 import json
 import time
 import logging
+import logging.handlers
+import queue
+import atexit
+import threading
 import uuid
-import math
+import weakref
 import re
-from typing import Optional, Dict, Any, List
-from datetime import datetime
-from collections import defaultdict
+import ast
+import asyncio
+import operator
+from functools import lru_cache
+from typing import Optional, Dict, Any, List, Deque, Mapping
+from types import MappingProxyType
+from collections import Counter, deque
+from itertools import chain, islice, count
 from pathlib import Path
 
 import google.generativeai as genai
 
+try:
+    import orjson
+except ImportError:  # optional: falls back to the stdlib encoder
+    orjson = None
+
+
+def _dumps(obj: Any) -> str:
+    """Serialize to a JSON string, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj)
+
+
+def _dumps_indented(obj: Any) -> bytes:
+    """Serialize to indented JSON bytes, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2).encode()
+
+
+def _loads(data: bytes) -> Any:
+    """Parse JSON bytes, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+# Patterns are compiled once at import; each check is a single regex pass
+_SANITIZE = re.compile(r'[^0-9+\-*/().\s]')
+_CALC_RE = re.compile(r'calculate|compute|math|add|multiply')
+_TEXT_RE = re.compile(r'count|reverse|uppercase|lowercase')
+_OP_RE = re.compile(
+    r'(?P<count_chars>characters)|(?P<reverse>reverse)'
+    r'|(?P<uppercase>uppercase)|(?P<lowercase>lowercase)'
+)
+_PREF_RE = re.compile(r'i like|i prefer')
+_LANGUAGE_RE = re.compile(r'(?P<Python>python)|(?P<JavaScript>javascript)')
+
+# Limits on ** so an expression like 9**9**9 can't stall the calculator
+_MAX_EXPONENT = 1000
+_MAX_POW_BITS = 100_000
+
+
+def _bounded_pow(base, exponent):
+    """Raise base to exponent, rejecting results too large to compute quickly."""
+    if abs(exponent) > _MAX_EXPONENT or (
+        isinstance(base, int) and base.bit_length() * abs(exponent) > _MAX_POW_BITS
+    ):
+        raise ValueError("Exponent too large")
+    return operator.pow(base, exponent)
+
+
+# Arithmetic supported by the calculator; anything else is rejected
+_BIN_OPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Pow: _bounded_pow,
+}
+_UNARY_OPS = {
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+
+
+@lru_cache(maxsize=256)
+def _compile_expr(expression: str) -> ast.expr:
+    """Parse an arithmetic expression once and cache its AST."""
+    return ast.parse(expression.strip(), mode='eval').body
+
+
+def _eval(node: ast.expr):
+    """Evaluate a parsed arithmetic expression without eval()."""
+    node_type = type(node)
+    if node_type is ast.BinOp and type(node.op) in _BIN_OPS:
+        return _BIN_OPS[type(node.op)](_eval(node.left), _eval(node.right))
+    if node_type is ast.UnaryOp and type(node.op) in _UNARY_OPS:
+        return _UNARY_OPS[type(node.op)](_eval(node.operand))
+    if node_type is ast.Constant and type(node.value) in (int, float):
+        return node.value
+    raise ValueError(f"Unsupported expression: {ast.unparse(node)}")
+
 
 # ============================================================================
 # Tool System (Day 2)
@@ -36,225 +129,473 @@ class CalculatorTool:
     def execute(self, expression: str) -> str:
         """Safely evaluate mathematical expressions."""
         try:
-            expression = re.sub(r'[^0-9+\-*/().\s]', '', expression)
-            result = eval(expression, {"__builtins__": {}}, {"math": math})
+            expression = _SANITIZE.sub('', expression)
+            result = _eval(_compile_expr(expression))
             return f"Result: {result}"
         except Exception as e:
             return f"Error: {str(e)}"
 
 
+def _op_count_words(text: str) -> str:
+    return f"Word count: {len(text.split())}"
+
+
+def _op_count_chars(text: str) -> str:
+    return f"Character count: {len(text)}"
+
+
+def _op_reverse(text: str) -> str:
+    return f"Reversed: {text[::-1]}"
+
+
+def _op_uppercase(text: str) -> str:
+    return f"Uppercase: {text.upper()}"
+
+
+def _op_lowercase(text: str) -> str:
+    return f"Lowercase: {text.lower()}"
+
+
 class TextProcessorTool:
     """Tool for text processing operations."""
     
+    # Built once for the class instead of on every execute() call
+    _OPS = {
+        "count_words": _op_count_words,
+        "count_chars": _op_count_chars,
+        "reverse": _op_reverse,
+        "uppercase": _op_uppercase,
+        "lowercase": _op_lowercase,
+    }
+    
     def __init__(self):
         self.name = "text_processor"
         self.description = "Processes text (count, reverse, transform)"
     
     def execute(self, text: str, operation: str = "count_words") -> str:
         """Process text based on operation."""
-        operations = {
-            "count_words": lambda t: f"Word count: {len(t.split())}",
-            "count_chars": lambda t: f"Character count: {len(t)}",
-            "reverse": lambda t: f"Reversed: {t[::-1]}",
-            "uppercase": lambda t: f"Uppercase: {t.upper()}",
-            "lowercase": lambda t: f"Lowercase: {t.lower()}",
-        }
-        
-        if operation in operations:
-            return operations[operation](text)
-        return f"Unknown operation: {operation}"
+        fn = self._OPS.get(operation)
+        return fn(text) if fn else f"Unknown operation: {operation}"
 
 
 # ============================================================================
 # Memory System (Day 3)
 # ============================================================================
 
+# Display names for the known roles; each message shares these strings
+_DISPLAY_ROLES = {"user": "User", "assistant": "Assistant", "system": "System"}
+
+
+class Message:
+    """A single conversation message."""
+    
+    # Many messages per conversation: skip the per-instance __dict__
+    __slots__ = ("role", "content", "display_role", "timestamp")
+    
+    def __init__(self, role: str, content: str, display_role: str, timestamp: float = 0.0):
+        self.role = role
+        self.content = content
+        self.display_role = display_role
+        self.timestamp = timestamp
+
+
+class LLMSummarizingCondenser:
+    """Condenses older conversation turns into a short LLM-written summary."""
+    
+    def __init__(self, model: Any, keep_turns: int = 2):
+        self.model = model
+        # Most recent turns that stay verbatim when history is condensed
+        self.keep_turns = keep_turns
+    
+    def condense(self, messages: List[Message], previous_summary: Optional[str] = None) -> str:
+        """Summarize messages, folding in any earlier summary."""
+        transcript = "\n".join(f"{msg.display_role}: {msg.content}" for msg in messages)
+        prompt = (
+            "Summarize this conversation in a few sentences, keeping names, "
+            "preferences, and facts the user shared.\n\n"
+            + (f"Earlier summary: {previous_summary}\n\n" if previous_summary else "")
+            + transcript
+        )
+        return self.model.generate_content(prompt).text
+
+
 class ShortTermMemory:
     """Short-term memory for conversation history."""
     
-    def __init__(self, max_history: int = 10):
+    def __init__(
+        self,
+        max_history: int = 10,
+        condenser: Optional[LLMSummarizingCondenser] = None,
+        store_timestamps: bool = False
+    ):
         self.max_history = max_history
-        self.conversation_history: List[Dict[str, str]] = []
+        self.store_timestamps = store_timestamps
+        # Bounded FIFO: the oldest messages are evicted automatically
+        self.conversation_history: Deque[Message] = deque(maxlen=max_history * 2)
+        # Rendered context per num_turns, valid until the next add_message
+        self._ctx_cache: Dict[int, str] = {}
+        
+        # With a condenser, older turns are summarized instead of dropped;
+        # turns moved out of the history stay in _pending, and in the
+        # context, until the summary that covers them lands
+        self.condenser = condenser
+        self.summary: Optional[str] = None
+        self._pending: List[Message] = []
+        # Guards summary, _pending and _ctx_cache; never held during an LLM call
+        self._summary_lock = threading.Lock()
+        # Runs summary jobs one at a time so each builds on the previous one
+        self._condense_lock = threading.Lock()
     
     def add_message(self, role: str, content: str):
         """Add message to conversation history."""
-        self.conversation_history.append({
-            "role": role,
-            "content": content,
-            "timestamp": datetime.now().isoformat()
-        })
+        timestamp = time.time() if self.store_timestamps else 0.0
+        display_role = _DISPLAY_ROLES.get(role) or role.capitalize()
+        self.conversation_history.append(Message(role, content, display_role, timestamp))
+        with self._summary_lock:
+            self._ctx_cache.clear()
         
-        if len(self.conversation_history) > self.max_history * 2:
-            self.conversation_history = self.conversation_history[-self.max_history * 2:]
+        if self.condenser and len(self.conversation_history) == self.conversation_history.maxlen:
+            self._condense()
+    
+    def _condense(self):
+        """Move older turns out of the history and summarize them in the background."""
+        keep = min(self.condenser.keep_turns * 2, len(self.conversation_history) - 1)
+        older = [self.conversation_history.popleft() for _ in range(len(self.conversation_history) - keep)]
+        with self._summary_lock:
+            self._pending.extend(older)
+            self._ctx_cache.clear()
+        threading.Thread(target=self._summarize, daemon=True).start()
+    
+    def _summarize(self):
+        """Fold the pending turns into the running summary."""
+        with self._condense_lock:
+            with self._summary_lock:
+                messages = list(self._pending)
+                summary = self.summary
+            if not messages:
+                return
+            
+            try:
+                summary = self.condenser.condense(messages, summary)
+            except Exception as e:
+                # The turns stay pending, and the next job retries them
+                print(f"Error summarizing conversation: {e}")
+                return
+            
+            with self._summary_lock:
+                self.summary = summary
+                del self._pending[:len(messages)]
+                self._ctx_cache.clear()
     
     def get_recent_context(self, num_turns: int = 5) -> str:
         """Get recent conversation context."""
-        if not self.conversation_history:
-            return ""
-        
-        recent = self.conversation_history[-num_turns * 2:]
-        return "\n".join([f"{msg['role'].capitalize()}: {msg['content']}" for msg in recent])
+        with self._summary_lock:
+            if not self.conversation_history and not self.summary and not self._pending:
+                return ""
+            
+            cached = self._ctx_cache.get(num_turns)
+            if cached is not None:
+                return cached
+            
+            start = max(0, len(self.conversation_history) - num_turns * 2)
+            recent = chain(self._pending, islice(self.conversation_history, start, None))
+            context = "\n".join([f"{msg.display_role}: {msg.content}" for msg in recent])
+            if self.summary:
+                context = f"Summary of earlier conversation: {self.summary}\n{context}"
+            self._ctx_cache[num_turns] = context
+            return context
+
+
+# Shared read-only result for users without stored preferences
+_EMPTY_PREFS: Mapping[str, Any] = MappingProxyType({})
 
 
 class LongTermMemory:
     """Long-term memory for user preferences."""
     
-    def __init__(self, storage_path: str = "capstone_memory.json"):
+    def __init__(self, storage_path: str = "capstone_memory.json", flush_interval: float = 1.0):
         self.storage_path = Path(storage_path)
         self.memory = self._load_memory()
+        
+        # Updates are coalesced, so writes are deferred: a change reaches the
+        # file on the next save_preference/_maybe_flush call made once
+        # flush_interval has passed, on _maybe_flush(force=True), or, if it
+        # is still pending, when this object is collected or at exit.
+        self.flush_interval = flush_interval
+        self._last_flush = time.monotonic()
+        # The pending write is a weakref.finalize, which (unlike atexit)
+        # doesn't keep the instance alive; None or dead when nothing is pending
+        self._pending: Optional[weakref.finalize] = None
     
     def _load_memory(self) -> Dict[str, Any]:
         """Load memory from storage."""
         if self.storage_path.exists():
             try:
-                with open(self.storage_path, 'r') as f:
-                    return json.load(f)
+                with open(self.storage_path, 'rb') as f:
+                    return _loads(f.read())
             except:
                 return {"users": {}, "preferences": {}}
         return {"users": {}, "preferences": {}}
     
-    def _save_memory(self):
+    @staticmethod
+    def _save_memory(memory: Dict[str, Any], storage_path: Path):
         """Save memory to storage."""
+        # Write to a temp file and swap it in, so a crash never leaves a truncated file
+        tmp_path = storage_path.with_suffix('.tmp')
         try:
-            with open(self.storage_path, 'w') as f:
-                json.dump(self.memory, f, indent=2)
+            with open(tmp_path, 'wb') as f:
+                f.write(_dumps_indented(memory))
+            os.replace(tmp_path, storage_path)
         except Exception as e:
             print(f"Error saving memory: {e}")
     
-    def get_user_preferences(self, user_id: str) -> Dict[str, Any]:
-        """Get user preferences."""
+    def _mark_dirty(self):
+        """Schedule a write of the current memory."""
+        if self._pending is None or not self._pending.alive:
+            self._pending = weakref.finalize(self, LongTermMemory._save_memory, self.memory, self.storage_path)
+    
+    def _flush(self):
+        """Write pending changes to storage."""
+        if self._pending is not None:
+            self._pending()  # runs the write at most once
+        self._last_flush = time.monotonic()
+    
+    def _maybe_flush(self, force: bool = False):
+        """Flush pending changes if forced or the flush interval has elapsed."""
+        pending = self._pending is not None and self._pending.alive
+        if pending and (force or time.monotonic() - self._last_flush > self.flush_interval):
+            self._flush()
+    
+    def get_user_preferences(self, user_id: str) -> Mapping[str, Any]:
+        """Get user preferences without creating an entry for unknown users."""
+        user = self.memory["users"].get(user_id)
+        if user is None:
+            return _EMPTY_PREFS
+        return user.get("preferences", _EMPTY_PREFS)
+    
+    def _ensure_user(self, user_id: str) -> Dict[str, Any]:
+        """Get the stored entry for a user, creating it if needed."""
         if user_id not in self.memory["users"]:
             self.memory["users"][user_id] = {"preferences": {}}
-        return self.memory["users"][user_id].get("preferences", {})
+        return self.memory["users"][user_id]
     
     def save_preference(self, user_id: str, key: str, value: Any):
         """Save user preference."""
-        if user_id not in self.memory["users"]:
-            self.memory["users"][user_id] = {"preferences": {}}
-        self.memory["users"][user_id]["preferences"][key] = value
-        self._save_memory()
+        self._ensure_user(user_id)["preferences"][key] = value
+        self._mark_dirty()
+        self._maybe_flush()
 
 
 # ============================================================================
 # Observability System (Day 4)
 # ============================================================================
 
+def _percentiles(times) -> tuple[float, float, float]:
+    """Return (p50, p95, p99) of a sequence of response times."""
+    ordered = sorted(times)
+    n = len(ordered)
+    if n == 0:
+        return 0.0, 0.0, 0.0
+    
+    def pick(q: float) -> float:
+        return ordered[min(int(n * q), n - 1)]
+    
+    return pick(0.50), pick(0.95), pick(0.99)
+
+
 class MetricsCollector:
     """Collects performance metrics."""
     
-    def __init__(self):
-        self.metrics = {
-            "requests_total": 0,
-            "requests_success": 0,
-            "requests_error": 0,
-            "total_response_time": 0.0,
-            "total_tokens": 0,
-            "tools_used": defaultdict(int),
-        }
-        self.request_times: List[float] = []
+    # Counters are plain slot attributes rather than entries in a dict, so each
+    # update is a direct attribute store with no key hashing.
+    __slots__ = (
+        "requests_total",
+        "requests_success",
+        "requests_error",
+        "total_response_time",
+        "total_tokens",
+        "tools_used",
+        "request_times",
+    )
+    
+    def __init__(self, window: int = 8192):
+        self.requests_total = 0
+        self.requests_success = 0
+        self.requests_error = 0
+        self.total_response_time = 0.0
+        self.total_tokens = 0
+        # Keyed by the tools' interned name literals, so each update hashes
+        # nothing new and the key probe is an identity match
+        self.tools_used: Counter = Counter()
+        # Ring buffer of the most recent response times; totals above stay exact
+        self.request_times: Deque[float] = deque(maxlen=window)
     
     def record_request(self, success: bool, response_time: float, tokens: int = 0, tool_used: Optional[str] = None):
         """Record request metrics."""
-        self.metrics["requests_total"] += 1
-        self.metrics["total_response_time"] += response_time
-        self.metrics["total_tokens"] += tokens
+        self.requests_total += 1
+        self.total_response_time += response_time
+        self.total_tokens += tokens
         self.request_times.append(response_time)
         
         if success:
-            self.metrics["requests_success"] += 1
+            self.requests_success += 1
         else:
-            self.metrics["requests_error"] += 1
+            self.requests_error += 1
         
         if tool_used:
-            self.metrics["tools_used"][tool_used] += 1
+            self.tools_used[tool_used] += 1
     
     def get_stats(self) -> Dict[str, Any]:
         """Get aggregated statistics."""
-        total = self.metrics["requests_total"]
+        total = self.requests_total
         if total == 0:
             return {"message": "No requests recorded"}
         
-        avg_time = self.metrics["total_response_time"] / total
-        success_rate = (self.metrics["requests_success"] / total) * 100
+        avg_time = self.total_response_time / total
+        success_rate = (self.requests_success / total) * 100
+        p50, p95, p99 = _percentiles(self.request_times)
         
         return {
             "total_requests": total,
             "success_rate": f"{success_rate:.2f}%",
             "average_response_time_seconds": f"{avg_time:.3f}",
-            "total_tokens": self.metrics["total_tokens"],
-            "tools_used": dict(self.metrics["tools_used"])
+            "p50_response_time_seconds": f"{p50:.3f}",
+            "p95_response_time_seconds": f"{p95:.3f}",
+            "p99_response_time_seconds": f"{p99:.3f}",
+            "total_tokens": self.total_tokens,
+            "tools_used": dict(self.tools_used)
         }
 
 
+_LOG_LEVELS = {
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "warning": logging.WARNING,
+    "error": logging.ERROR,
+    "critical": logging.CRITICAL,
+}
+
+
+class _StructuredFormatter(logging.Formatter):
+    """Appends the structured fields as JSON, only when a record is emitted."""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        message = super().format(record)
+        fields = getattr(record, "_kw", None)
+        return f"{message} | {_dumps(fields)}" if fields else message
+
+
 class StructuredLogger:
     """Structured logger for agent operations."""
     
+    # One background listener owns the real stream handler for all loggers,
+    # so callers only enqueue records and never block on stderr writes.
+    _queue: Optional[queue.SimpleQueue] = None
+    _listener: Optional[logging.handlers.QueueListener] = None
+    _lock = threading.Lock()
+    
     def __init__(self, name: str = "capstone_agent"):
         self.logger = logging.getLogger(name)
         self.logger.setLevel(logging.INFO)
-        handler = logging.StreamHandler()
-        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-        self.logger.addHandler(handler)
+        if not any(isinstance(h, logging.handlers.QueueHandler) for h in self.logger.handlers):
+            self.logger.addHandler(logging.handlers.QueueHandler(self._get_queue()))
+    
+    @classmethod
+    def _get_queue(cls) -> queue.SimpleQueue:
+        """Return the shared log queue, starting its listener on first use."""
+        with cls._lock:
+            if cls._listener is None:
+                cls._queue = queue.SimpleQueue()
+                handler = logging.StreamHandler()
+                handler.setFormatter(_StructuredFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+                cls._listener = logging.handlers.QueueListener(cls._queue, handler)
+                cls._listener.start()
+                atexit.register(cls._listener.stop)
+        return cls._queue
     
     def log(self, level: str, message: str, **kwargs):
         """Log with structured data."""
-        extra_msg = f" | {json.dumps(kwargs)}" if kwargs else ""
-        getattr(self.logger, level.lower())(f"{message}{extra_msg}")
+        lvl = _LOG_LEVELS[level.lower()]
+        if not self.logger.isEnabledFor(lvl):
+            return
+        self.logger.log(lvl, message, extra={"_kw": kwargs})
 
 
 # ============================================================================
 # Main Capstone Agent
 # ============================================================================
 
+@lru_cache(maxsize=8)
+def _get_model(api_key: str, model_name: str) -> genai.GenerativeModel:
+    """Configure the SDK and build a model once per (api_key, model_name)."""
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(model_name)
+
+
+# Per-process request counter; combined with time_ns() it gives unique ids
+_REQ_CTR = count()
+
+
+def _approx_tokens(text: str) -> int:
+    """Estimate token count with the usual ~4 characters per token heuristic."""
+    return (len(text) + 3) >> 2
+
+
 class CapstoneAgent:
     """Comprehensive AI agent integrating tools, memory, and observability."""
     
-    def __init__(self, api_key: Optional[str] = None, user_id: str = "default"):
-        """Initialize capstone agent."""
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        user_id: str = "default",
+        uuid_request_ids: bool = False,
+        summarize_history: bool = False
+    ):
+        """Initialize capstone agent.
+        
+        Set uuid_request_ids when request IDs must be unique across processes.
+        Set summarize_history to condense older turns into an LLM summary
+        instead of dropping them when short-term memory fills up.
+        """
         self.api_key = api_key or os.getenv("GOOGLE_API_KEY")
         if not self.api_key:
             raise ValueError("GOOGLE_API_KEY environment variable required")
         
-        genai.configure(api_key=self.api_key)
-        self.model = genai.GenerativeModel('gemini-pro')
+        self.model = _get_model(self.api_key, 'gemini-pro')
         
         # Initialize tools (Day 2)
-        self.tools = {
-            "calculator": CalculatorTool(),
-            "text_processor": TextProcessorTool(),
-        }
+        self.tools = {tool.name: tool for tool in (CalculatorTool(), TextProcessorTool())}
         
         # Initialize memory (Day 3)
-        self.short_term_memory = ShortTermMemory(max_history=10)
+        condenser = LLMSummarizingCondenser(self.model) if summarize_history else None
+        self.short_term_memory = ShortTermMemory(max_history=10, condenser=condenser)
         self.long_term_memory = LongTermMemory()
         self.user_id = user_id
+        # Live reference to the stored preferences, refreshed when one is saved
+        self._prefs = self.long_term_memory.get_user_preferences(user_id)
         
         # Initialize observability (Day 4)
         self.metrics = MetricsCollector()
         self.logger = StructuredLogger()
         self.request_id = None
+        self.uuid_request_ids = uuid_request_ids
     
     def _generate_request_id(self) -> str:
         """Generate unique request ID."""
-        return str(uuid.uuid4())
+        if self.uuid_request_ids:
+            return str(uuid.uuid4())
+        return f"{time.time_ns():x}-{next(_REQ_CTR):x}"
     
     def _select_tool(self, query: str) -> tuple[Optional[str], Optional[Dict[str, Any]]]:
         """Determine which tool to use."""
         query_lower = query.lower()
         
-        if any(kw in query_lower for kw in ["calculate", "compute", "math", "add", "multiply"]):
+        if _CALC_RE.search(query_lower):
             return "calculator", {"expression": query}
         
-        if any(kw in query_lower for kw in ["count", "reverse", "uppercase", "lowercase"]):
-            operation = "count_words"
-            if "characters" in query_lower:
-                operation = "count_chars"
-            elif "reverse" in query_lower:
-                operation = "reverse"
-            elif "uppercase" in query_lower:
-                operation = "uppercase"
-            elif "lowercase" in query_lower:
-                operation = "lowercase"
+        if _TEXT_RE.search(query_lower):
+            match = _OP_RE.search(query_lower)
+            operation = match.lastgroup if match else "count_words"
             return "text_processor", {"text": query, "operation": operation}
         
         return None, None
@@ -263,95 +604,126 @@ class CapstoneAgent:
         """Extract user preference from message."""
         message_lower = message.lower()
         
-        if "i like" in message_lower or "i prefer" in message_lower:
-            if "python" in message_lower:
-                return ("favorite_language", "Python")
-            elif "javascript" in message_lower:
-                return ("favorite_language", "JavaScript")
+        if _PREF_RE.search(message_lower):
+            match = _LANGUAGE_RE.search(message_lower)
+            if match:
+                return ("favorite_language", match.lastgroup)
         
         return None
     
+    def _prepare_turn(self, message: str) -> tuple[str, Optional[str]]:
+        """Update memory, run any tool, and build the prompt for a message."""
+        # Check for preference updates
+        preference = self._extract_preference(message)
+        if preference:
+            key, value = preference
+            self.long_term_memory.save_preference(self.user_id, key, value)
+            self._prefs = self.long_term_memory.get_user_preferences(self.user_id)
+            self.logger.log("INFO", "Preference saved", key=key, value=value)
+        
+        # Add user message to short-term memory
+        self.short_term_memory.add_message("user", message)
+        
+        # Get context
+        context = self.short_term_memory.get_recent_context(num_turns=3)
+        preferences = self._prefs
+        
+        # Check if tool is needed
+        tool_name, tool_params = self._select_tool(message)
+        tool_result = None
+        
+        if tool_name:
+            self.logger.log("INFO", "Tool selected", tool=tool_name)
+            tool_result = self.tools[tool_name].execute(**tool_params)
+            self.metrics.record_request(True, 0, tool_used=tool_name)
+        
+        # Build prompt
+        prefs_str = ", ".join(f"{k}: {v}" for k, v in preferences.items()) if preferences else ""
+        prompt = (
+            (f"User preferences: {prefs_str}\n\n" if preferences else "")
+            + (f"Recent conversation:\n{context}\n\n" if context else "")
+            + (f"Tool result: {tool_result}\n\n" if tool_result else "")
+            + f"User message: {message}"
+        )
+        return prompt, tool_name
+    
+    def _finish_turn(
+        self,
+        request_id: str,
+        message: str,
+        response_text: str,
+        tool_name: Optional[str],
+        start_time: float
+    ) -> str:
+        """Store the response and record metrics for a completed request."""
+        # Add response to short-term memory
+        self.short_term_memory.add_message("assistant", response_text)
+        
+        # Record metrics
+        response_time = time.time() - start_time
+        estimated_tokens = _approx_tokens(message) + _approx_tokens(response_text)
+        self.metrics.record_request(True, response_time, tokens=estimated_tokens, tool_used=tool_name)
+        
+        self.logger.log("INFO", "Request completed", 
+                      request_id=request_id, 
+                      response_time=response_time,
+                      tokens=estimated_tokens)
+        
+        return response_text
+    
+    def _fail_turn(self, request_id: str, error: Exception, start_time: float) -> str:
+        """Record metrics and log a failed request."""
+        response_time = time.time() - start_time
+        self.metrics.record_request(False, response_time)
+        self.logger.log("ERROR", "Request failed", 
+                      request_id=request_id, 
+                      error=str(error))
+        return f"Error: {str(error)}"
+    
     def chat(self, message: str) -> str:
         """Process message with full capabilities."""
-        self.request_id = self._generate_request_id()
+        request_id = self.request_id = self._generate_request_id()
         start_time = time.time()
         
         # Log request start
-        self.logger.log("INFO", "Request started", request_id=self.request_id, user_id=self.user_id)
+        self.logger.log("INFO", "Request started", request_id=request_id, user_id=self.user_id)
         
         try:
-            # Check for preference updates
-            preference = self._extract_preference(message)
-            if preference:
-                key, value = preference
-                self.long_term_memory.save_preference(self.user_id, key, value)
-                self.logger.log("INFO", "Preference saved", key=key, value=value)
-            
-            # Add user message to short-term memory
-            self.short_term_memory.add_message("user", message)
-            
-            # Get context
-            context = self.short_term_memory.get_recent_context(num_turns=3)
-            preferences = self.long_term_memory.get_user_preferences(self.user_id)
-            
-            # Check if tool is needed
-            tool_name, tool_params = self._select_tool(message)
-            tool_result = None
-            
-            if tool_name:
-                self.logger.log("INFO", "Tool selected", tool=tool_name)
-                tool_result = self.tools[tool_name].execute(**tool_params)
-                self.metrics.record_request(True, 0, tool_used=tool_name)
-            
-            # Build prompt
-            prompt_parts = []
-            
-            if preferences:
-                prefs_str = ", ".join([f"{k}: {v}" for k, v in preferences.items()])
-                prompt_parts.append(f"User preferences: {prefs_str}")
-            
-            if context:
-                prompt_parts.append(f"Recent conversation:\n{context}")
-            
-            if tool_result:
-                prompt_parts.append(f"Tool result: {tool_result}")
-            
-            prompt_parts.append(f"User message: {message}")
-            
-            prompt = "\n\n".join(prompt_parts)
+            prompt, tool_name = self._prepare_turn(message)
             
             # Generate response
             response = self.model.generate_content(prompt)
-            response_text = response.text
-            
-            # Add response to short-term memory
-            self.short_term_memory.add_message("assistant", response_text)
-            
-            # Record metrics
-            response_time = time.time() - start_time
-            estimated_tokens = len(message.split()) + len(response_text.split())
-            self.metrics.record_request(True, response_time, tokens=estimated_tokens, tool_used=tool_name)
-            
-            self.logger.log("INFO", "Request completed", 
-                          request_id=self.request_id, 
-                          response_time=response_time,
-                          tokens=estimated_tokens)
+            return self._finish_turn(request_id, message, response.text, tool_name, start_time)
+        
+        except Exception as e:
+            return self._fail_turn(request_id, e, start_time)
+    
+    async def achat(self, message: str) -> str:
+        """Async variant of chat() that overlaps the LLM call with persistence."""
+        request_id = self.request_id = self._generate_request_id()
+        start_time = time.time()
+        
+        # Log request start
+        self.logger.log("INFO", "Request started", request_id=request_id, user_id=self.user_id)
+        
+        try:
+            prompt, tool_name = self._prepare_turn(message)
             
-            return response_text
+            # Generate response while pending memory writes are flushed
+            response, _ = await asyncio.gather(
+                asyncio.to_thread(self.model.generate_content, prompt),
+                asyncio.to_thread(self.long_term_memory._maybe_flush),
+            )
+            return self._finish_turn(request_id, message, response.text, tool_name, start_time)
         
         except Exception as e:
-            response_time = time.time() - start_time
-            self.metrics.record_request(False, response_time)
-            self.logger.log("ERROR", "Request failed", 
-                          request_id=self.request_id, 
-                          error=str(e))
-            return f"Error: {str(e)}"
+            return self._fail_turn(request_id, e, start_time)
     
     def get_observability_report(self) -> Dict[str, Any]:
         """Get comprehensive observability report."""
         return {
             "metrics": self.metrics.get_stats(),
-            "user_preferences": self.long_term_memory.get_user_preferences(self.user_id),
+            "user_preferences": dict(self._prefs),
             "conversation_turns": len(self.short_term_memory.conversation_history) // 2
         }
     
@@ -6,11 +6,173 @@ with Google Search for real-time information retrieval.
 """
 
 import os
+import re
+import sys
+import json
+import asyncio
+import math
+import time
+import hashlib
+import threading
 import google.generativeai as genai
 import requests
-from typing import Optional, List, Dict
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional, List, Dict, Any, Iterator, Union
 from urllib.parse import quote
 
+try:
+    import orjson
+except ImportError:  # optional: falls back to the stdlib encoder
+    orjson = None
+
+
+class ResponseCache:
+    """Thread-safe in-process LRU cache with an optional per-entry TTL."""
+    
+    def __init__(self, maxsize: int = 512, ttl: Optional[float] = None):
+        """
+        Initialize the cache.
+        
+        Args:
+            maxsize: Maximum number of entries to keep
+            ttl: Seconds before an entry goes stale (None: never)
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stats = {"hits": 0, "misses": 0}
+        self._entries: "OrderedDict[str, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value for key, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[1]
+    
+    def put(self, key: str, value: Any):
+        """Store a value, evicting the least recently used entry when full."""
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+def _cache_key(**parts: Any) -> str:
+    """Build a stable cache key from the parts of a request."""
+    if orjson is not None:
+        payload = orjson.dumps(parts, option=orjson.OPT_SORT_KEYS, default=str)
+    else:
+        payload = json.dumps(parts, sort_keys=True, default=str).encode()
+    return hashlib.sha256(payload).hexdigest()
+
+
+def _loads(data: Union[bytes, str]) -> Any:
+    """Parse JSON, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class SemanticCache:
+    """Reuses answers for messages whose embeddings are near-duplicates."""
+    
+    def __init__(
+        self,
+        threshold: float = 0.92,
+        maxsize: int = 512,
+        embedding_model: str = "models/embedding-001"
+    ):
+        """
+        Initialize the semantic cache.
+        
+        Args:
+            threshold: Minimum cosine similarity that counts as a hit
+            maxsize: Maximum number of cached answers
+            embedding_model: Gemini embedding model used for messages
+        """
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.embedding_model = embedding_model
+        self._vectors: List[List[float]] = []
+        self._responses: List[str] = []
+        self._lock = threading.Lock()
+    
+    def embed(self, text: str) -> List[float]:
+        """Embed text as an L2-normalized vector."""
+        vector = genai.embed_content(model=self.embedding_model, content=text)["embedding"]
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+    
+    def lookup(self, embedding: List[float]) -> Optional[str]:
+        """Return the answer for the most similar cached message, if close enough."""
+        with self._lock:
+            best_score, best_index = -1.0, -1
+            for i, vector in enumerate(self._vectors):
+                score = sum(a * b for a, b in zip(embedding, vector))
+                if score > best_score:
+                    best_score, best_index = score, i
+            if best_score > self.threshold:
+                return self._responses[best_index]
+        return None
+    
+    def add(self, embedding: List[float], response: str):
+        """Cache an answer, dropping the oldest one when full."""
+        with self._lock:
+            self._vectors.append(embedding)
+            self._responses.append(response)
+            if len(self._vectors) > self.maxsize:
+                del self._vectors[0], self._responses[0]
+
+
+# Keywords that suggest a query needs real-time information
+_TIME_SENSITIVE_KEYWORDS = [
+    "current", "latest", "recent", "today", "now", "2024", "2025",
+    "news", "happening", "what is", "who is", "when did"
+]
+_SEARCH_RE = re.compile(
+    r"\b(" + "|".join(map(re.escape, _TIME_SENSITIVE_KEYWORDS)) + r")\b",
+    re.IGNORECASE
+)
+
+# Static instructions go first so repeated search prompts share a
+# cacheable prefix; search results and the question are appended after
+_SEARCH_PROMPT_PREFIX = (
+    "Answer the user's question based on the search results below. "
+    "Provide a comprehensive answer using the search results. "
+    "Cite sources when appropriate.\n\n"
+)
+
+# Answers can depend on live search results, so entries expire
+_RESPONSE_CACHE = ResponseCache(maxsize=512, ttl=300)
+
+
+def _build_session() -> requests.Session:
+    """Create an HTTP session that pools connections and retries transient errors."""
+    retry = Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    return session
+
+
+@lru_cache(maxsize=4)
+def _get_model(api_key: str, name: str = "gemini-pro") -> genai.GenerativeModel:
+    """Configure the SDK and build a model once per (api_key, name)."""
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(name)
+
 
 class SearchIntegratedAgent:
     """An AI agent that integrates Google Search for real-time information."""
@@ -19,7 +181,8 @@ class SearchIntegratedAgent:
         self,
         api_key: Optional[str] = None,
         search_api_key: Optional[str] = None,
-        search_engine_id: Optional[str] = None
+        search_engine_id: Optional[str] = None,
+        semantic_cache: bool = False
     ):
         """
         Initialize the agent with API keys.
@@ -28,14 +191,15 @@ class SearchIntegratedAgent:
             api_key: Google Gemini API key
             search_api_key: Google Custom Search API key
             search_engine_id: Google Custom Search Engine ID
+            semantic_cache: Reuse answers for paraphrased non-search queries
         """
         # Configure Gemini
         self.api_key = api_key or os.getenv("GOOGLE_API_KEY")
         if not self.api_key:
             raise ValueError("GOOGLE_API_KEY environment variable required")
         
-        genai.configure(api_key=self.api_key)
-        self.model = genai.GenerativeModel('gemini-pro')
+        self.model = _get_model(self.api_key)
+        self.semantic_cache = SemanticCache() if semantic_cache else None
         
         # Configure Google Search
         self.search_api_key = search_api_key or os.getenv("GOOGLE_SEARCH_API_KEY")
@@ -48,6 +212,9 @@ class SearchIntegratedAgent:
         else:
             self.search_enabled = True
             self.search_url = "https://www.googleapis.com/customsearch/v1"
+        
+        # Reuse TLS connections across searches instead of reconnecting per query
+        self.session = _build_session()
     
     def search(self, query: str, num_results: int = 3) -> List[Dict[str, str]]:
         """
@@ -71,10 +238,10 @@ class SearchIntegratedAgent:
                 "num": num_results
             }
             
-            response = requests.get(self.search_url, params=params)
+            response = self.session.get(self.search_url, params=params)
             response.raise_for_status()
             
-            data = response.json()
+            data = _loads(response.content)
             results = []
             
             for item in data.get("items", []):
@@ -101,26 +268,42 @@ class SearchIntegratedAgent:
             True if search is needed, False otherwise
         """
         # Simple heuristic: check for time-sensitive or current event keywords
-        time_sensitive_keywords = [
-            "current", "latest", "recent", "today", "now", "2024", "2025",
-            "news", "happening", "what is", "who is", "when did"
-        ]
-        
-        query_lower = query.lower()
-        return any(keyword in query_lower for keyword in time_sensitive_keywords)
+        return bool(_SEARCH_RE.search(query))
     
-    def chat(self, message: str) -> str:
+    def chat(self, message: str, *, _decision: Optional[bool] = None) -> str:
         """
         Process a message with optional search integration.
         
         Args:
             message: User's message/query
+            _decision: Precomputed search decision, if the caller already has one
             
         Returns:
             Agent's response
         """
+        return "".join(self.chat_stream(message, _decision=_decision))
+    
+    def chat_stream(self, message: str, *, _decision: Optional[bool] = None) -> Iterator[str]:
+        """
+        Process a message like chat(), yielding the response as it is generated.
+        
+        Args:
+            message: User's message/query
+            _decision: Precomputed search decision, if the caller already has one
+            
+        Returns:
+            Iterator over chunks of the agent's response
+        """
+        cache_key = _cache_key(model="gemini-pro", message=message, search_enabled=self.search_enabled)
+        cached = _RESPONSE_CACHE.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+        
         # Check if search is needed
-        if self.search_enabled and self.needs_search(message):
+        if _decision is None:
+            _decision = self.search_enabled and self.needs_search(message)
+        if _decision:
             print("🔍 Searching for real-time information...")
             search_results = self.search(message)
             
@@ -133,24 +316,38 @@ class SearchIntegratedAgent:
                     context += f"   Source: {result['link']}\n\n"
                 
                 # Combine search results with user query
-                prompt = f"""Based on the following search results, answer the user's question.
-
-{context}
-
-User Question: {message}
-
-Provide a comprehensive answer using the search results above. Cite sources when appropriate."""
+                prompt = f"{_SEARCH_PROMPT_PREFIX}{context}User Question: {message}"
             else:
                 prompt = message
         else:
             prompt = message
         
+        # Only answers that don't depend on live search are reused semantically
+        # (the prompt is the bare message when no search results were used)
+        embedding = None
+        if self.semantic_cache and prompt is message:
+            try:
+                embedding = self.semantic_cache.embed(message)
+                similar = self.semantic_cache.lookup(embedding)
+                if similar is not None:
+                    yield similar
+                    return
+            except Exception as e:
+                print(f"Semantic cache error: {e}")
+        
         try:
-            response = self.model.generate_content(prompt)
-            return response.text
+            chunks = []
+            for chunk in self.model.generate_content(prompt, stream=True):
+                chunks.append(chunk.text)
+                yield chunk.text
+            
+            response_text = "".join(chunks)
+            _RESPONSE_CACHE.put(cache_key, response_text)
+            if embedding is not None:
+                self.semantic_cache.add(embedding, response_text)
         
         except Exception as e:
-            return f"Error: {str(e)}"
+            yield f"Error: {str(e)}"
     
     def run(self, query: str) -> dict:
         """
@@ -163,7 +360,7 @@ Provide a comprehensive answer using the search results above. Cite sources when
             Dictionary with query, response, and search info
         """
         used_search = self.search_enabled and self.needs_search(query)
-        response = self.chat(query)
+        response = self.chat(query, _decision=used_search)
         
         return {
             "query": query,
@@ -171,6 +368,22 @@ Provide a comprehensive answer using the search results above. Cite sources when
             "used_search": used_search,
             "model": "gemini-pro"
         }
+    
+    async def run_many(self, queries: List[str]) -> List[dict]:
+        """
+        Run several queries concurrently.
+        
+        The search and Gemini calls are blocking network requests, so each
+        query runs in a worker thread and the total wait is roughly that of
+        the slowest query rather than the sum of all of them.
+        
+        Args:
+            queries: User queries
+            
+        Returns:
+            Results in the same order as the queries
+        """
+        return await asyncio.gather(*(asyncio.to_thread(self.run, q) for q in queries))
 
 
 def main():
@@ -205,17 +418,30 @@ def main():
     print("-" * 60)
     print()
     
-    for i, query in enumerate(examples, 1):
+    results = asyncio.run(agent.run_many(examples))
+    
+    for i, (query, result) in enumerate(zip(examples, results), 1):
         print(f"Query {i}: {query}")
         print()
         
-        result = agent.run(query)
         print(f"Response: {result['response']}")
         if result['used_search']:
             print("\n[Used Google Search for real-time information]")
         print()
         print("-" * 60)
         print()
+    
+    # Stream a response so text appears as soon as the first chunk arrives
+    query = "Explain how neural networks learn."
+    print(f"Streaming query: {query}")
+    print()
+    print("Response: ", end="")
+    for chunk in agent.chat_stream(query):
+        sys.stdout.write(chunk)
+        sys.stdout.flush()
+    print()
+    print()
+    print("-" * 60)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,135 @@
+"""
+Shared caching helpers for the Day 2 agents
+
+Response caching, semantic (embedding-based) caching, JSON parsing and
+model construction used by both api_agent.py and tool_integration.py.
+"""
+
+import json
+import math
+import time
+import hashlib
+import threading
+import google.generativeai as genai
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional, Any, List, Union
+
+try:
+    import orjson
+except ImportError:  # optional: falls back to the stdlib encoder
+    orjson = None
+
+
+class ResponseCache:
+    """Thread-safe in-process LRU cache with an optional per-entry TTL."""
+    
+    def __init__(self, maxsize: int = 512, ttl: Optional[float] = None):
+        """
+        Initialize the cache.
+        
+        Args:
+            maxsize: Maximum number of entries to keep
+            ttl: Seconds before an entry goes stale (None: never)
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stats = {"hits": 0, "misses": 0}
+        self._entries: "OrderedDict[str, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value for key, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[1]
+    
+    def put(self, key: str, value: Any):
+        """Store a value, evicting the least recently used entry when full."""
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+def make_cache_key(**parts: Any) -> str:
+    """Build a stable cache key from the parts of a request."""
+    if orjson is not None:
+        payload = orjson.dumps(parts, option=orjson.OPT_SORT_KEYS, default=str)
+    else:
+        payload = json.dumps(parts, sort_keys=True, default=str).encode()
+    return hashlib.sha256(payload).hexdigest()
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    """Parse JSON, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class SemanticCache:
+    """Reuses answers for messages whose embeddings are near-duplicates."""
+    
+    def __init__(
+        self,
+        threshold: float = 0.92,
+        maxsize: int = 512,
+        embedding_model: str = "models/embedding-001"
+    ):
+        """
+        Initialize the semantic cache.
+        
+        Args:
+            threshold: Minimum cosine similarity that counts as a hit
+            maxsize: Maximum number of cached answers
+            embedding_model: Gemini embedding model used for messages
+        """
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.embedding_model = embedding_model
+        self._vectors: List[List[float]] = []
+        self._responses: List[str] = []
+        self._lock = threading.Lock()
+    
+    def embed(self, text: str) -> List[float]:
+        """Embed text as an L2-normalized vector."""
+        vector = genai.embed_content(model=self.embedding_model, content=text)["embedding"]
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+    
+    def lookup(self, embedding: List[float]) -> Optional[str]:
+        """Return the answer for the most similar cached message, if close enough."""
+        with self._lock:
+            best_score, best_index = -1.0, -1
+            for i, vector in enumerate(self._vectors):
+                score = sum(a * b for a, b in zip(embedding, vector))
+                if score > best_score:
+                    best_score, best_index = score, i
+            if best_score > self.threshold:
+                return self._responses[best_index]
+        return None
+    
+    def add(self, embedding: List[float], response: str):
+        """Cache an answer, dropping the oldest one when full."""
+        with self._lock:
+            self._vectors.append(embedding)
+            self._responses.append(response)
+            if len(self._vectors) > self.maxsize:
+                del self._vectors[0], self._responses[0]
+
+
+@lru_cache(maxsize=4)
+def get_model(api_key: str, name: str = "gemini-pro") -> genai.GenerativeModel:
+    """Configure the SDK and build a model once per (api_key, name)."""
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(name)
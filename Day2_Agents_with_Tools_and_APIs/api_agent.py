@@ -6,24 +6,107 @@ to fetch and process data from external services.
 """
 
 import os
+import re
+import sys
 import json
+import asyncio
 import requests
-import google.generativeai as genai
-from typing import Optional, Dict, Any, List
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Optional, Dict, Any, List, Iterator, NamedTuple
 from datetime import datetime
 
+try:
+    import orjson
+except ImportError:  # optional: falls back to the stdlib encoder
+    orjson = None
+
+from agent_cache import ResponseCache, SemanticCache, make_cache_key, loads, get_model
+
+
+def _dumps(obj: Any) -> str:
+    """Serialize to compact JSON, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, separators=(",", ":"))
+
+
+# Keyword groups for rule-based API selection, each matched in one pass
+_PLACEHOLDER_RE = re.compile(r"\b(?:post|user|comment|todo)", re.IGNORECASE)
+_COUNTRY_RE = re.compile(r"\b(?:country|countries|nation)", re.IGNORECASE)
+_POST_RE = re.compile(r"post", re.IGNORECASE)
+_USER_RE = re.compile(r"user", re.IGNORECASE)
+_FEW_RE = re.compile(r"first|few", re.IGNORECASE)
+_ALL_RE = re.compile(r"\ball\b", re.IGNORECASE)
+
+# Marks an argument that was not passed, since None is a valid API decision
+_UNSET = object()
+
+# Static instructions go first so repeated API prompts share a
+# cacheable prefix; the fetched payload and question are appended after
+_API_PROMPT_PREFIX = (
+    "Answer the user's question using the API data below.\n"
+    "If the data is a list, summarize the key information.\n"
+    "If the data is an object, extract the relevant details.\n\n"
+)
+
+# Limits on how much API data is put into a prompt
+_MAX_PROMPT_ITEMS = 20
+_COUNTRY_FIELDS = ("name", "capital", "population")
+
+# API payloads can change upstream, so they expire; LLM answers are keyed
+# by the full prompt (which embeds the payload) and kept until evicted
+_API_CACHE = ResponseCache(maxsize=512, ttl=300)
+_RESPONSE_CACHE = ResponseCache(maxsize=512)
+
+
+class APIResult(NamedTuple):
+    """Outcome of a single REST API request (immutable, so safe to cache)."""
+    success: bool
+    data: Any = None
+    status_code: int = 0
+    error: str = ""
+
+
+def _compact_payload(api_data: Any) -> Any:
+    """Trim an API payload to the parts worth spending prompt tokens on."""
+    if isinstance(api_data, list):
+        api_data = api_data[:_MAX_PROMPT_ITEMS]
+        # REST Countries objects carry dozens of fields; keep the basics
+        return [
+            {field: item[field] for field in _COUNTRY_FIELDS if field in item}
+            if isinstance(item, dict) and "population" in item else item
+            for item in api_data
+        ]
+    return api_data
+
+
+def _build_session() -> requests.Session:
+    """Create an HTTP session that pools connections and retries transient errors."""
+    retry = Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    return session
+
 
 class APIAgent:
     """An AI agent that can interact with REST APIs."""
     
-    def __init__(self, api_key: Optional[str] = None):
-        """Initialize the agent."""
+    def __init__(self, api_key: Optional[str] = None, semantic_cache: bool = False):
+        """
+        Initialize the agent.
+        
+        Args:
+            api_key: Google Gemini API key
+            semantic_cache: Reuse answers for paraphrased queries that need no API
+        """
         self.api_key = api_key or os.getenv("GOOGLE_API_KEY")
         if not self.api_key:
             raise ValueError("GOOGLE_API_KEY environment variable required")
         
-        genai.configure(api_key=self.api_key)
-        self.model = genai.GenerativeModel('gemini-pro')
+        self.model = get_model(self.api_key)
+        self.semantic_cache = SemanticCache() if semantic_cache else None
         
         # Define available APIs (using free public APIs for examples)
         self.available_apis = {
@@ -36,8 +119,11 @@ class APIAgent:
                 "description": "Country information API"
             },
         }
+        
+        # Reuse TLS connections across API calls instead of reconnecting per query
+        self.session = _build_session()
     
-    def fetch_api_data(self, api_name: str, endpoint: str, params: Optional[Dict] = None) -> Dict[str, Any]:
+    def fetch_api_data(self, api_name: str, endpoint: str, params: Optional[Dict] = None) -> APIResult:
         """
         Fetch data from a REST API.
         
@@ -50,27 +136,41 @@ class APIAgent:
             API response data
         """
         if api_name not in self.available_apis:
-            return {"error": f"Unknown API: {api_name}"}
+            return APIResult(False, error=f"Unknown API: {api_name}")
+        
+        cache_key = make_cache_key(api_name=api_name, endpoint=endpoint, params=params or {})
+        cached = _API_CACHE.get(cache_key)
+        if cached is not None:
+            return cached
         
         base_url = self.available_apis[api_name]["base_url"]
         url = f"{base_url}/{endpoint.lstrip('/')}"
         
         try:
-            response = requests.get(url, params=params, timeout=10)
+            response = self.session.get(url, params=params, timeout=10)
             response.raise_for_status()
             
-            return {
-                "success": True,
-                "data": response.json(),
-                "status_code": response.status_code
-            }
-        except requests.exceptions.RequestException as e:
-            return {
-                "success": False,
-                "error": str(e)
-            }
-    
-    def process_api_data(self, data: Dict[str, Any], query: str) -> str:
+            result = APIResult(True, loads(response.content), response.status_code)
+            _API_CACHE.put(cache_key, result)
+            return result
+        except (requests.exceptions.RequestException, ValueError) as e:
+            return APIResult(False, error=str(e))
+    
+    def _generate_stream(self, prompt: str) -> Iterator[str]:
+        """Stream a response, reusing the cached answer for a repeated prompt."""
+        cache_key = make_cache_key(model="gemini-pro", prompt=prompt)
+        cached = _RESPONSE_CACHE.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+        
+        chunks = []
+        for chunk in self.model.generate_content(prompt, stream=True):
+            chunks.append(chunk.text)
+            yield chunk.text
+        _RESPONSE_CACHE.put(cache_key, "".join(chunks))
+    
+    def process_api_data(self, data: APIResult, query: str) -> str:
         """
         Process API data using LLM to answer user query.
         
@@ -81,28 +181,25 @@ class APIAgent:
         Returns:
             Processed response
         """
-        if not data.get("success"):
-            return f"Error fetching data: {data.get('error', 'Unknown error')}"
+        return "".join(self._process_api_data_stream(data, query))
+    
+    def _process_api_data_stream(self, data: APIResult, query: str) -> Iterator[str]:
+        """Stream the answer built by process_api_data()."""
+        if not data.success:
+            yield f"Error fetching data: {data.error or 'Unknown error'}"
+            return
         
-        api_data = data.get("data", {})
+        api_data = _compact_payload(data.data if data.data is not None else {})
         
-        # Format data for LLM
-        data_str = json.dumps(api_data, indent=2)
+        # Format data for LLM; compact separators since whitespace costs tokens
+        data_str = _dumps(api_data)
         
-        prompt = f"""The user asked: {query}
-
-I fetched the following data from an API:
-{data_str}
-
-Based on this data, provide a helpful answer to the user's question.
-If the data is a list, summarize the key information.
-If the data is an object, extract the relevant details."""
+        prompt = f"{_API_PROMPT_PREFIX}API data:\n{data_str}\n\nThe user asked: {query}"
         
         try:
-            response = self.model.generate_content(prompt)
-            return response.text
+            yield from self._generate_stream(prompt)
         except Exception as e:
-            return f"Error processing data: {str(e)}"
+            yield f"Error processing data: {str(e)}"
     
     def determine_api_call(self, query: str) -> Optional[Dict[str, Any]]:
         """
@@ -111,25 +208,23 @@ If the data is an object, extract the relevant details."""
         Returns:
             Dict with api_name, endpoint, and params, or None
         """
-        query_lower = query.lower()
-        
         # Simple rule-based API selection (in production, use LLM)
-        if any(keyword in query_lower for keyword in ["post", "user", "comment", "todo"]):
-            if "post" in query_lower or "posts" in query_lower:
+        if _PLACEHOLDER_RE.search(query):
+            if _POST_RE.search(query):
                 return {
                     "api_name": "jsonplaceholder",
                     "endpoint": "/posts",
-                    "params": {"_limit": 5} if "first" in query_lower or "few" in query_lower else None
+                    "params": {"_limit": 5} if _FEW_RE.search(query) else None
                 }
-            elif "user" in query_lower:
+            elif _USER_RE.search(query):
                 return {
                     "api_name": "jsonplaceholder",
                     "endpoint": "/users",
                     "params": None
                 }
         
-        if any(keyword in query_lower for keyword in ["country", "countries", "nation"]):
-            if "all" in query_lower:
+        if _COUNTRY_RE.search(query):
+            if _ALL_RE.search(query):
                 return {
                     "api_name": "restcountries",
                     "endpoint": "/all",
@@ -137,20 +232,24 @@ If the data is an object, extract the relevant details."""
                 }
             else:
                 # Extract country name (simplified)
-                words = query_lower.split()
+                words = query.split()
                 for word in words:
                     if len(word) > 3:  # Potential country name
                         return {
                             "api_name": "restcountries",
-                            "endpoint": f"/name/{word}",
+                            "endpoint": f"/name/{word.lower()}",
                             "params": None
                         }
         
         return None
     
-    def chat(self, message: str) -> str:
+    def chat(self, message: str, *, _api_call: Any = _UNSET) -> str:
         """Process a message, potentially calling APIs."""
-        api_call = self.determine_api_call(message)
+        return "".join(self.chat_stream(message, _api_call=_api_call))
+    
+    def chat_stream(self, message: str, *, _api_call: Any = _UNSET) -> Iterator[str]:
+        """Process a message like chat(), yielding the response as it is generated."""
+        api_call = self.determine_api_call(message) if _api_call is _UNSET else _api_call
         
         if api_call:
             print(f"🌐 Calling API: {api_call['api_name']} - {api_call['endpoint']}")
@@ -160,19 +259,35 @@ If the data is an object, extract the relevant details."""
                 api_call.get("params")
             )
             
-            return self.process_api_data(api_data, message)
+            yield from self._process_api_data_stream(api_data, message)
         else:
-            # No API call needed, use LLM directly
+            # No API call needed, use LLM directly; API-backed answers are
+            # never matched semantically since their data can change
+            embedding = None
+            if self.semantic_cache:
+                try:
+                    embedding = self.semantic_cache.embed(message)
+                    similar = self.semantic_cache.lookup(embedding)
+                    if similar is not None:
+                        yield similar
+                        return
+                except Exception as e:
+                    print(f"Semantic cache error: {e}")
+            
             try:
-                response = self.model.generate_content(message)
-                return response.text
+                chunks = []
+                for chunk in self._generate_stream(message):
+                    chunks.append(chunk)
+                    yield chunk
+                if embedding is not None:
+                    self.semantic_cache.add(embedding, "".join(chunks))
             except Exception as e:
-                return f"Error: {str(e)}"
+                yield f"Error: {str(e)}"
     
     def run(self, query: str) -> dict:
         """Run the agent with a query."""
         api_call = self.determine_api_call(query)
-        response = self.chat(query)
+        response = self.chat(query, _api_call=api_call)
         
         return {
             "query": query,
@@ -180,6 +295,19 @@ If the data is an object, extract the relevant details."""
             "api_used": api_call["api_name"] if api_call else None,
             "available_apis": list(self.available_apis.keys())
         }
+    
+    async def run_many(self, queries: List[str]) -> List[dict]:
+        """
+        Run several queries concurrently.
+        
+        API and Gemini calls are blocking network requests, so each query
+        runs in a worker thread and the total wait is roughly that of the
+        slowest query rather than the sum of all of them.
+        
+        Returns:
+            Results in the same order as the queries
+        """
+        return await asyncio.gather(*(asyncio.to_thread(self.run, q) for q in queries))
 
 
 def main():
@@ -211,17 +339,30 @@ def main():
     print("-" * 60)
     print()
     
-    for i, query in enumerate(examples, 1):
+    results = asyncio.run(agent.run_many(examples))
+    
+    for i, (query, result) in enumerate(zip(examples, results), 1):
         print(f"Query {i}: {query}")
         print()
         
-        result = agent.run(query)
         print(f"Response: {result['response']}")
         if result['api_used']:
             print(f"\n[Used API: {result['api_used']}]")
         print()
         print("-" * 60)
         print()
+    
+    # Stream a response so text appears as soon as the first chunk arrives
+    query = "Explain what a REST API is."
+    print(f"Streaming query: {query}")
+    print()
+    print("Response: ", end="")
+    for chunk in agent.chat_stream(query):
+        sys.stdout.write(chunk)
+        sys.stdout.flush()
+    print()
+    print()
+    print("-" * 60)
 
 
 if __name__ == "__main__":
@@ -6,19 +6,104 @@ complex queries requiring calculations, searches, and data processing.
 """
 
 import os
+import sys
+import ast
 import json
-import math
-import google.generativeai as genai
-from typing import Optional, Dict, Any, List
+import operator
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Optional, Dict, Any, List, Iterator
 import re
+from concurrent.futures import ThreadPoolExecutor
+
+from agent_cache import ResponseCache, SemanticCache, make_cache_key, loads, get_model
+
+
+# Keyword groups for rule-based tool selection, each matched in one pass
+_CALC_RE = re.compile(r"\b(?:calculate|compute|math|add|multiply|divide)", re.IGNORECASE)
+_TEXT_RE = re.compile(r"\b(?:count words|count characters|reverse|uppercase|lowercase)", re.IGNORECASE)
+_NUM_RE = re.compile(r"\d+(?:\.\d+)?")
+_OP_RE = re.compile(
+    r"(?P<count_chars>char(?:acter)?s)|(?P<reverse>reverse)"
+    r"|(?P<uppercase>upper)|(?P<lowercase>lower)",
+    re.IGNORECASE
+)
+
+# Characters the calculator keeps before parsing an expression
+_CALC_SCRUB = re.compile(r"[^0-9+\-*/().\s]")
+
+# Limits on ** so an expression like 9**9**9 can't stall the calculator
+_MAX_EXPONENT = 1000
+_MAX_POW_BITS = 100_000
+
+
+def _bounded_pow(base, exponent):
+    """Raise base to exponent, rejecting results too large to compute quickly."""
+    if abs(exponent) > _MAX_EXPONENT or (
+        isinstance(base, int) and base.bit_length() * abs(exponent) > _MAX_POW_BITS
+    ):
+        raise ValueError("Exponent too large")
+    return operator.pow(base, exponent)
+
+
+# Arithmetic supported by the calculator; anything else is rejected
+_SAFE_BINOPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Pow: _bounded_pow,
+}
+_SAFE_UNARYOPS = {
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+
+
+@lru_cache(maxsize=1024)
+def _parse_expr(expression: str) -> ast.expr:
+    """Parse a scrubbed arithmetic expression once and cache its AST."""
+    return ast.parse(expression.strip(), mode='eval').body
+
+
+def _eval_node(node: ast.expr):
+    """Evaluate a parsed arithmetic expression without eval()."""
+    node_type = type(node)
+    if node_type is ast.BinOp and type(node.op) in _SAFE_BINOPS:
+        return _SAFE_BINOPS[type(node.op)](_eval_node(node.left), _eval_node(node.right))
+    if node_type is ast.UnaryOp and type(node.op) in _SAFE_UNARYOPS:
+        return _SAFE_UNARYOPS[type(node.op)](_eval_node(node.operand))
+    if node_type is ast.Constant and type(node.value) in (int, float):
+        return node.value
+    raise ValueError(f"Unsupported expression: {ast.unparse(node)}")
+
+
+@lru_cache(maxsize=4096)
+def _evaluate(expression: str):
+    """Evaluate a scrubbed expression, reusing the result for repeats."""
+    return _eval_node(_parse_expr(expression))
+
+
+# Static instructions go first so repeated tool prompts share a
+# cacheable prefix; the tool output and question are appended after
+_TOOL_PROMPT_PREFIX = (
+    "A tool was used to help answer the user's question. "
+    "Provide a helpful response to the user based on the tool result below.\n\n"
+)
+
+# Tool results are deterministic, so answers are cached without expiry
+_RESPONSE_CACHE = ResponseCache(maxsize=512)
 
 
 class Tool:
     """Base class for tools."""
     
-    def __init__(self, name: str, description: str):
+    def __init__(self, name: str, description: str, is_terminal: bool = False):
         self.name = name
         self.description = description
+        # Terminal tools produce a final, human-readable answer on their own
+        self.is_terminal = is_terminal
     
     def execute(self, **kwargs) -> str:
         """Execute the tool with given parameters."""
@@ -31,18 +116,52 @@ class CalculatorTool(Tool):
     def __init__(self):
         super().__init__(
             name="calculator",
-            description="Performs mathematical calculations. Input: mathematical expression as string."
+            description="Performs mathematical calculations. Input: mathematical expression as string.",
+            is_terminal=True
         )
     
     def execute(self, expression: str) -> str:
         """Evaluate a mathematical expression safely."""
-        try:
-            # Remove any non-math characters for safety
-            expression = re.sub(r'[^0-9+\-*/().\s]', '', expression)
-            result = eval(expression, {"__builtins__": {}}, {"math": math})
-            return f"Result: {result}"
-        except Exception as e:
-            return f"Error calculating: {str(e)}"
+        return _calculate(expression)
+
+
+def _calculate(expression: str) -> str:
+    try:
+        # Remove any non-math characters for safety
+        expression = _CALC_SCRUB.sub('', expression)
+        result = _evaluate(expression)
+        return f"Result: {result}"
+    except Exception as e:
+        return f"Error calculating: {str(e)}"
+
+
+def _count_words(text: str) -> str:
+    return f"Word count: {len(text.split())}"
+
+
+def _count_chars(text: str) -> str:
+    return f"Character count: {len(text)}"
+
+
+def _reverse(text: str) -> str:
+    return f"Reversed: {text[::-1]}"
+
+
+def _uppercase(text: str) -> str:
+    return f"Uppercase: {text.upper()}"
+
+
+def _lowercase(text: str) -> str:
+    return f"Lowercase: {text.lower()}"
+
+
+_TEXT_OPS = MappingProxyType({
+    "count_words": _count_words,
+    "count_chars": _count_chars,
+    "reverse": _reverse,
+    "uppercase": _uppercase,
+    "lowercase": _lowercase,
+})
 
 
 class TextProcessorTool(Tool):
@@ -51,35 +170,33 @@ class TextProcessorTool(Tool):
     def __init__(self):
         super().__init__(
             name="text_processor",
-            description="Processes text: count words, characters, reverse, uppercase, lowercase."
+            description="Processes text: count words, characters, reverse, uppercase, lowercase.",
+            is_terminal=True
         )
     
     def execute(self, text: str, operation: str = "count_words") -> str:
         """Process text based on operation."""
-        operations = {
-            "count_words": lambda t: f"Word count: {len(t.split())}",
-            "count_chars": lambda t: f"Character count: {len(t)}",
-            "reverse": lambda t: f"Reversed: {t[::-1]}",
-            "uppercase": lambda t: f"Uppercase: {t.upper()}",
-            "lowercase": lambda t: f"Lowercase: {t.lower()}",
-        }
-        
-        if operation in operations:
-            return operations[operation](text)
-        return f"Unknown operation: {operation}"
+        fn = _TEXT_OPS.get(operation)
+        return fn(text) if fn else f"Unknown operation: {operation}"
 
 
 class ToolIntegratedAgent:
     """An AI agent that can use multiple tools."""
     
-    def __init__(self, api_key: Optional[str] = None):
-        """Initialize the agent with tools."""
+    def __init__(self, api_key: Optional[str] = None, semantic_cache: bool = False):
+        """
+        Initialize the agent with tools.
+        
+        Args:
+            api_key: Google Gemini API key
+            semantic_cache: Reuse answers for paraphrased queries that need no tool
+        """
         self.api_key = api_key or os.getenv("GOOGLE_API_KEY")
         if not self.api_key:
             raise ValueError("GOOGLE_API_KEY environment variable required")
         
-        genai.configure(api_key=self.api_key)
-        self.model = genai.GenerativeModel('gemini-pro')
+        self.model = get_model(self.api_key)
+        self.semantic_cache = SemanticCache() if semantic_cache else None
         
         # Register available tools
         self.tools = {
@@ -102,27 +219,19 @@ class ToolIntegratedAgent:
             Tuple of (tool_name, parameters) or (None, None)
         """
         # Simple rule-based tool selection (in production, use LLM for this)
-        query_lower = query.lower()
         
         # Check for calculator needs
-        if any(keyword in query_lower for keyword in ["calculate", "compute", "math", "add", "multiply", "divide"]):
+        if _CALC_RE.search(query):
             # Extract mathematical expression
             # Simple extraction - in production, use more sophisticated parsing
-            numbers = re.findall(r'\d+\.?\d*', query)
+            numbers = _NUM_RE.findall(query)
             if len(numbers) >= 2:
                 return "calculator", {"expression": query}
         
         # Check for text processing needs
-        if any(keyword in query_lower for keyword in ["count words", "count characters", "reverse", "uppercase", "lowercase"]):
-            operation = "count_words"
-            if "characters" in query_lower or "chars" in query_lower:
-                operation = "count_chars"
-            elif "reverse" in query_lower:
-                operation = "reverse"
-            elif "uppercase" in query_lower or "upper" in query_lower:
-                operation = "uppercase"
-            elif "lowercase" in query_lower or "lower" in query_lower:
-                operation = "lowercase"
+        if _TEXT_RE.search(query):
+            match = _OP_RE.search(query)
+            operation = match.lastgroup if match else "count_words"
             
             # Extract text (simplified - in production, use better extraction)
             return "text_processor", {"text": query, "operation": operation}
@@ -140,35 +249,138 @@ class ToolIntegratedAgent:
         except Exception as e:
             return f"Error executing tool: {str(e)}"
     
-    def chat(self, message: str) -> str:
+    def chat(
+        self,
+        message: str,
+        *,
+        _tool: Optional[tuple[Optional[str], Optional[Dict[str, Any]]]] = None
+    ) -> str:
         """Process a message, potentially using tools."""
+        return "".join(self.chat_stream(message, _tool=_tool))
+    
+    def chat_stream(
+        self,
+        message: str,
+        *,
+        _tool: Optional[tuple[Optional[str], Optional[Dict[str, Any]]]] = None
+    ) -> Iterator[str]:
+        """Process a message like chat(), yielding the response as it is generated."""
+        cache_key = make_cache_key(model="gemini-pro", message=message)
+        cached = _RESPONSE_CACHE.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+        
         # Check if tools are needed
-        tool_name, parameters = self.select_tool(message)
+        tool_name, parameters = self.select_tool(message) if _tool is None else _tool
         
         if tool_name:
             print(f"🔧 Using tool: {tool_name}")
             tool_result = self.execute_tool(tool_name, parameters)
             
+            # A successful terminal tool result already answers the query;
+            # failures still go to the model so it can respond helpfully
+            tool = self.tools.get(tool_name)
+            if tool and tool.is_terminal and not tool_result.startswith(("Error", "Unknown")):
+                yield tool_result
+                return
+            
             # Build prompt with tool result
-            prompt = f"""User asked: {message}
-
-I used the {tool_name} tool and got this result: {tool_result}
-
-Now provide a helpful response to the user based on this result."""
+            prompt = (
+                f"{_TOOL_PROMPT_PREFIX}"
+                f"Tool: {tool_name}\n"
+                f"Result: {tool_result}\n\n"
+                f"User asked: {message}"
+            )
         else:
             # No tool needed, use LLM directly
             prompt = message
         
+        # Tool answers depend on exact numbers/text, so only plain queries
+        # are matched semantically
+        embedding = None
+        if self.semantic_cache and not tool_name:
+            try:
+                embedding = self.semantic_cache.embed(message)
+                similar = self.semantic_cache.lookup(embedding)
+                if similar is not None:
+                    yield similar
+                    return
+            except Exception as e:
+                print(f"Semantic cache error: {e}")
+        
         try:
-            response = self.model.generate_content(prompt)
-            return response.text
+            chunks = []
+            for chunk in self.model.generate_content(prompt, stream=True):
+                chunks.append(chunk.text)
+                yield chunk.text
+            
+            response_text = "".join(chunks)
+            _RESPONSE_CACHE.put(cache_key, response_text)
+            if embedding is not None:
+                self.semantic_cache.add(embedding, response_text)
         except Exception as e:
-            return f"Error: {str(e)}"
+            yield f"Error: {str(e)}"
+    
+    def run_batch(self, queries: List[str]) -> List[str]:
+        """
+        Answer several independent queries with as few model calls as possible.
+        
+        Queries that need a tool still go through chat() one by one; all plain
+        queries are answered together by a single generate_content call.
+        
+        Args:
+            queries: User queries to answer
+            
+        Returns:
+            Responses in the same order as queries
+        """
+        responses: List[Optional[str]] = [None] * len(queries)
+        plain = []
+        
+        for i, query in enumerate(queries):
+            cached = _RESPONSE_CACHE.get(make_cache_key(model="gemini-pro", message=query))
+            if cached is not None:
+                responses[i] = cached
+            else:
+                tool = self.select_tool(query)
+                if tool[0]:
+                    responses[i] = self.chat(query, _tool=tool)
+                else:
+                    plain.append(i)
+        
+        if len(plain) > 1:
+            numbered = "\n".join(f"{n}. {queries[i]}" for n, i in enumerate(plain, 1))
+            prompt = (
+                "Answer each of the following numbered questions independently. "
+                "Return a JSON list of strings, one answer per question, in order.\n"
+                f"{numbered}"
+            )
+            try:
+                response = self.model.generate_content(
+                    prompt,
+                    generation_config={"response_mime_type": "application/json"}
+                )
+                answers = loads(response.text)
+                if not isinstance(answers, list) or len(answers) != len(plain):
+                    raise ValueError("batched response does not match the questions")
+                for i, answer in zip(plain, answers):
+                    responses[i] = str(answer)
+                    _RESPONSE_CACHE.put(make_cache_key(model="gemini-pro", message=queries[i]), responses[i])
+                plain = []
+            except Exception as e:
+                print(f"Batch request failed, answering individually: {e}")
+        
+        for i in plain:
+            responses[i] = self.chat(queries[i])
+        
+        return responses
     
     def run(self, query: str) -> dict:
         """Run the agent with a query."""
-        tool_name, _ = self.select_tool(query)
-        response = self.chat(query)
+        tool = self.select_tool(query)
+        tool_name = tool[0]
+        response = self.chat(query, _tool=tool)
         
         return {
             "query": query,
@@ -208,17 +420,34 @@ def main():
     print("-" * 60)
     print()
     
-    for i, query in enumerate(examples, 1):
-        print(f"Query {i}: {query}")
-        print()
+    # Submit every query up front so later ones are already running while
+    # earlier results are printed
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        futures = [pool.submit(agent.run, query) for query in examples]
         
-        result = agent.run(query)
-        print(f"Response: {result['response']}")
-        if result['tool_used']:
-            print(f"\n[Used tool: {result['tool_used']}]")
-        print()
-        print("-" * 60)
-        print()
+        for i, (query, future) in enumerate(zip(examples, futures), 1):
+            print(f"Query {i}: {query}")
+            print()
+            
+            result = future.result()
+            print(f"Response: {result['response']}")
+            if result['tool_used']:
+                print(f"\n[Used tool: {result['tool_used']}]")
+            print()
+            print("-" * 60)
+            print()
+    
+    # Stream a response so text appears as soon as the first chunk arrives
+    query = "Explain what a large language model is."
+    print(f"Streaming query: {query}")
+    print()
+    print("Response: ", end="")
+    for chunk in agent.chat_stream(query):
+        sys.stdout.write(chunk)
+        sys.stdout.flush()
+    print()
+    print()
+    print("-" * 60)
 
 
 if __name__ == "__main__":
@@ -6,35 +6,157 @@ and historical data (long-term memory).
 """
 
 import os
+import re
 import json
-import google.generativeai as genai
-from typing import Optional, Dict, Any, List
+import math
+import hashlib
+import time
+import atexit
+import sqlite3
+from collections import deque
+from itertools import islice
+from typing import Optional, Dict, Any, List, Deque
 from datetime import datetime
 from pathlib import Path
 
+try:
+    import msgpack
+except ImportError:  # optional: falls back to JSON storage
+    msgpack = None
+
+# Conversations kept per user
+MAX_CONVERSATIONS = 100
+
+# A preference statement, and the values it may name anywhere in the message
+_PREF_TRIGGER_RE = re.compile(r"\b(?:i like|i prefer|my favorite)\b", re.IGNORECASE)
+_PREF_VALUE_RE = re.compile(
+    r"\b(python|javascript|red|blue|green|yellow|purple|orange)\b",
+    re.IGNORECASE
+)
+# Matched value -> (preference key, stored value, words that must give context),
+# in priority order: languages before colors
+_PREF_VALUES = {
+    "python": ("favorite_language", "Python", re.compile(r"programming|language", re.IGNORECASE)),
+    "javascript": ("favorite_language", "JavaScript", re.compile(r"programming|language", re.IGNORECASE)),
+    **{
+        color: ("favorite_color", color, re.compile(r"color", re.IGNORECASE))
+        for color in ("red", "blue", "green", "yellow", "purple", "orange")
+    },
+}
+
+
+# Models shared by every agent, keyed by (api_key, model name)
+_MODEL_CACHE: Dict[tuple[str, str], Any] = {}
+
+
+def _get_model(api_key: str, model_name: str = "gemini-pro"):
+    """Configure the SDK and build a model once per key and model name."""
+    key = (api_key, model_name)
+    model = _MODEL_CACHE.get(key)
+    if model is None:
+        import google.generativeai as genai
+        
+        genai.configure(api_key=api_key)
+        model = _MODEL_CACHE[key] = genai.GenerativeModel(model_name)
+    return model
+
+
+def _to_epoch(timestamp: str) -> float:
+    """Convert an ISO timestamp to epoch seconds for storage."""
+    return datetime.fromisoformat(timestamp).timestamp()
+
 
 class LongTermMemory:
     """Manages long-term memory (persistent storage) for an agent."""
     
-    def __init__(self, storage_path: str = "agent_memory.json"):
+    def __init__(self, storage_path: str = "agent_memory.json", save_interval: float = 0.5):
         """
         Initialize long-term memory storage.
         
+        Preferences and patterns live in the storage file, whose suffix picks
+        the format: MessagePack for .mpk (requires msgpack), JSON otherwise.
+        Conversations are appended to a SQLite database next to it (same
+        name, .db suffix).
+        
         Args:
-            storage_path: Path to JSON file for persistent storage
+            storage_path: Path to the JSON (or .mpk) file for persistent storage
+            save_interval: Minimum seconds between automatic saves
         """
         self.storage_path = Path(storage_path)
+        self.db_path = self.storage_path.with_suffix(".db")
+        
+        # Without msgpack a .mpk file can be neither read nor written, and
+        # starting from empty memory would lose the user's data on next save
+        if msgpack is None and self.storage_path.suffix == ".mpk":
+            raise ImportError(
+                f"msgpack is required to use {self.storage_path}; "
+                "install it with 'pip install msgpack' or use a .json path"
+            )
+        
+        # Updates mark memory dirty and are written at most once per
+        # save_interval; flush() writes immediately, and runs again at exit
+        self.save_interval = save_interval
+        self._dirty = False
+        self._autosave = True
+        self._last_save = time.monotonic()
+        
+        self._db = self._open_db()
         self.memory: Dict[str, Any] = self._load_memory()
+        if self._dirty:
+            self.flush()
+        
+        # Recent (row id, conversation) pairs per user, loaded from the
+        # database on first use and kept in step with it afterwards
+        self._history: Dict[str, Deque[tuple[int, Dict[str, Any]]]] = {}
+        # Formatted "key: value" preference strings per user, dropped
+        # whenever that user's preferences change
+        self._prefs_str_cache: Dict[str, str] = {}
+        
+        atexit.register(self.flush)
+    
+    def _open_db(self) -> sqlite3.Connection:
+        """Open the conversation database, creating its table if needed."""
+        db = sqlite3.connect(self.db_path)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS conversations ("
+            "id INTEGER PRIMARY KEY, user_id TEXT, ts REAL, query TEXT, response TEXT)"
+        )
+        
+        db.execute("CREATE INDEX IF NOT EXISTS ix_user_ts ON conversations(user_id, ts)")
+        db.commit()
+        return db
     
     def _load_memory(self) -> Dict[str, Any]:
         """Load memory from persistent storage."""
-        if self.storage_path.exists():
+        path = self.storage_path
+        # Only the configured file is read; a MessagePack file beside a JSON
+        # one may hold the data the caller expected, so say so
+        packed = path.with_suffix(".mpk")
+        if path.suffix != ".mpk" and packed.exists():
+            print(f"Warning: {packed} exists next to {path}; pass it as storage_path to use it")
+        
+        if path.exists():
             try:
-                with open(self.storage_path, 'r') as f:
-                    return json.load(f)
+                if path.suffix == ".mpk":
+                    memory = msgpack.unpackb(path.read_bytes(), raw=False)
+                else:
+                    memory = json.loads(path.read_text())
             except Exception as e:
                 print(f"Error loading memory: {e}")
                 return self._initialize_memory()
+            
+            # Move conversations from older JSON files into the database
+            legacy = memory.pop("conversations", None)
+            if legacy:
+                with self._db:
+                    self._db.executemany(
+                        "INSERT INTO conversations (user_id, ts, query, response) VALUES (?, ?, ?, ?)",
+                        [(c["user_id"], _to_epoch(c["timestamp"]), c["query"], c["response"]) for c in legacy]
+                    )
+                self._dirty = True
+            return memory
         return self._initialize_memory()
     
     def _initialize_memory(self) -> Dict[str, Any]:
@@ -42,70 +164,119 @@ class LongTermMemory:
         return {
             "users": {},
             "preferences": {},
-            "conversations": [],
             "learned_patterns": {}
         }
     
     def _save_memory(self):
         """Save memory to persistent storage."""
         try:
-            with open(self.storage_path, 'w') as f:
-                json.dump(self.memory, f, indent=2)
+            # Encode in memory and write once rather than streaming many small writes
+            if self.storage_path.suffix == ".mpk":
+                self.storage_path.write_bytes(msgpack.packb(self.memory, use_bin_type=True))
+            else:
+                self.storage_path.write_text(json.dumps(self.memory, indent=2))
         except Exception as e:
             print(f"Error saving memory: {e}")
     
+    def flush(self):
+        """Write pending changes to persistent storage."""
+        if self._dirty:
+            self._save_memory()
+            self._dirty = False
+        self._last_save = time.monotonic()
+    
+    def _maybe_save(self):
+        """Mark memory dirty and save if the save interval has elapsed."""
+        self._dirty = True
+        if self._autosave and time.monotonic() - self._last_save >= self.save_interval:
+            self.flush()
+    
     def get_user_preferences(self, user_id: str = "default") -> Dict[str, Any]:
-        """Get user preferences."""
-        if user_id not in self.memory["users"]:
-            self.memory["users"][user_id] = {
-                "preferences": {},
-                "created_at": datetime.now().isoformat()
-            }
-        return self.memory["users"][user_id].get("preferences", {})
+        """Get user preferences (empty if the user is unknown; never creates them)."""
+        user = self.memory["users"].get(user_id)
+        return user.get("preferences", {}) if user else {}
+    
+    def get_preferences_str(self, user_id: str = "default") -> str:
+        """Get a user's preferences formatted for a prompt ("" if none)."""
+        prefs_str = self._prefs_str_cache.get(user_id)
+        if prefs_str is None:
+            preferences = self.get_user_preferences(user_id)
+            prefs_str = ", ".join(f"{k}: {v}" for k, v in preferences.items()) if preferences else ""
+            self._prefs_str_cache[user_id] = prefs_str
+        return prefs_str
     
-    def save_user_preference(self, user_id: str, key: str, value: Any):
-        """Save a user preference."""
-        if user_id not in self.memory["users"]:
-            self.memory["users"][user_id] = {
+    def _ensure_user(self, user_id: str, ts: str) -> Dict[str, Any]:
+        """Get a user's record, creating it if needed."""
+        user = self.memory["users"].get(user_id)
+        if user is None:
+            user = self.memory["users"][user_id] = {
                 "preferences": {},
-                "created_at": datetime.now().isoformat()
+                "created_at": ts
             }
-        
-        self.memory["users"][user_id]["preferences"][key] = value
-        self.memory["users"][user_id]["last_updated"] = datetime.now().isoformat()
-        self._save_memory()
+        return user
+    
+    def save_user_preference(self, user_id: str, key: str, value: Any, ts: Optional[str] = None):
+        """Save a user preference, stamped with ts (default: now)."""
+        ts = ts or datetime.now().isoformat()
+        user = self._ensure_user(user_id, ts)
+        user["preferences"][key] = value
+        user["last_updated"] = ts
+        self._prefs_str_cache.pop(user_id, None)
+        self._maybe_save()
     
-    def add_conversation(self, user_id: str, query: str, response: str):
-        """Add a conversation to history."""
+    def _user_history(self, user_id: str) -> Deque[tuple[int, Dict[str, Any]]]:
+        """Get the cached recent history for a user, loading it if needed."""
+        history = self._history.get(user_id)
+        if history is None:
+            rows = self._db.execute(
+                "SELECT id, query, response, ts FROM conversations "
+                "WHERE user_id = ? ORDER BY ts DESC, id DESC LIMIT ?",
+                (user_id, MAX_CONVERSATIONS)
+            ).fetchall()
+            history = deque(
+                ((row_id, {"user_id": user_id, "query": query, "response": response,
+                           "timestamp": datetime.fromtimestamp(ts).isoformat()})
+                 for row_id, query, response, ts in reversed(rows)),
+                maxlen=MAX_CONVERSATIONS
+            )
+            self._history[user_id] = history
+        return history
+    
+    def add_conversation(self, user_id: str, query: str, response: str, ts: Optional[str] = None):
+        """Add a conversation to history, stamped with ts (default: now)."""
+        history = self._user_history(user_id)
         conversation = {
             "user_id": user_id,
             "query": query,
             "response": response,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": ts or datetime.now().isoformat()
         }
-        self.memory["conversations"].append(conversation)
-        
-        # Keep only recent conversations (last 100)
-        if len(self.memory["conversations"]) > 100:
-            self.memory["conversations"] = self.memory["conversations"][-100:]
         
-        self._save_memory()
+        with self._db:
+            cursor = self._db.execute(
+                "INSERT INTO conversations (user_id, ts, query, response) VALUES (?, ?, ?, ?)",
+                (user_id, _to_epoch(conversation["timestamp"]), query, response)
+            )
+            # Keep only each user's recent conversations (last 100)
+            if len(history) == history.maxlen:
+                self._db.execute(
+                    "DELETE FROM conversations WHERE user_id = ? AND id <= ?",
+                    (user_id, history[0][0])
+                )
+        history.append((cursor.lastrowid, conversation))
     
     def get_user_history(self, user_id: str, limit: int = 10) -> List[Dict]:
         """Get user's conversation history."""
-        user_conversations = [
-            conv for conv in self.memory["conversations"]
-            if conv["user_id"] == user_id
-        ]
-        return user_conversations[-limit:]
+        recent = islice(reversed(self._user_history(user_id)), limit)
+        return [conversation for _, conversation in recent][::-1]
     
-    def learn_pattern(self, pattern_key: str, pattern_data: Any):
-        """Learn and store a pattern."""
+    def learn_pattern(self, pattern_key: str, pattern_data: Any, ts: Optional[str] = None):
+        """Learn and store a pattern, stamped with ts (default: now)."""
         self.memory["learned_patterns"][pattern_key] = {
             "data": pattern_data,
-            "learned_at": datetime.now().isoformat()
+            "learned_at": ts or datetime.now().isoformat()
         }
-        self._save_memory()
+        self._maybe_save()
     
     def get_learned_pattern(self, pattern_key: str) -> Optional[Any]:
         """Retrieve a learned pattern."""
@@ -114,6 +285,89 @@ class LongTermMemory:
         return None
 
 
+class SemanticCache:
+    """Reuses answers for near-duplicate queries, persisted next to long-term memory."""
+    
+    def __init__(
+        self,
+        db_path: Optional[Path] = None,
+        threshold: float = 0.9,
+        maxsize: int = 512,
+        embedding_model: str = "models/embedding-001"
+    ):
+        """
+        Initialize the semantic cache.
+        
+        Args:
+            db_path: SQLite database to persist entries in (None: in-memory only)
+            threshold: Minimum cosine similarity that counts as a hit
+            maxsize: Maximum number of cached answers
+            embedding_model: Gemini embedding model used for queries
+        """
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.embedding_model = embedding_model
+        self._scopes: List[str] = []
+        self._vectors: List[List[float]] = []
+        self._responses: List[str] = []
+        
+        self._db = sqlite3.connect(db_path) if db_path else None
+        if self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS semantic_cache ("
+                "id INTEGER PRIMARY KEY, scope TEXT, embedding TEXT, response TEXT)"
+            )
+            self._db.commit()
+            rows = self._db.execute(
+                "SELECT scope, embedding, response FROM semantic_cache ORDER BY id DESC LIMIT ?",
+                (maxsize,)
+            ).fetchall()
+            for scope, embedding, response in reversed(rows):
+                self._scopes.append(scope)
+                self._vectors.append(json.loads(embedding))
+                self._responses.append(response)
+    
+    def embed(self, text: str) -> List[float]:
+        """Embed normalized text as an L2-normalized vector."""
+        import google.generativeai as genai
+        
+        text = " ".join(text.lower().split())
+        vector = genai.embed_content(model=self.embedding_model, content=text)["embedding"]
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+    
+    def lookup(self, scope: str, embedding: List[float]) -> Optional[str]:
+        """Return the answer for the most similar cached query in scope, if close enough."""
+        best_score, best_index = -1.0, -1
+        for i, vector in enumerate(self._vectors):
+            if self._scopes[i] != scope:
+                continue
+            score = sum(a * b for a, b in zip(embedding, vector))
+            if score > best_score:
+                best_score, best_index = score, i
+        if best_score > self.threshold:
+            return self._responses[best_index]
+        return None
+    
+    def add(self, scope: str, embedding: List[float], response: str):
+        """Cache an answer, dropping the oldest one when full."""
+        self._scopes.append(scope)
+        self._vectors.append(embedding)
+        self._responses.append(response)
+        if len(self._vectors) > self.maxsize:
+            del self._scopes[0], self._vectors[0], self._responses[0]
+        
+        if self._db:
+            with self._db:
+                cursor = self._db.execute(
+                    "INSERT INTO semantic_cache (scope, embedding, response) VALUES (?, ?, ?)",
+                    (scope, json.dumps(embedding), response)
+                )
+                self._db.execute(
+                    "DELETE FROM semantic_cache WHERE id <= ?", (cursor.lastrowid - self.maxsize,)
+                )
+
+
 class AgentWithLongTermMemory:
     """An AI agent with long-term memory capabilities."""
     
@@ -121,7 +375,8 @@ class AgentWithLongTermMemory:
         self,
         api_key: Optional[str] = None,
         storage_path: str = "agent_memory.json",
-        user_id: str = "default"
+        user_id: str = "default",
+        semantic_cache: bool = False
     ):
         """
         Initialize the agent with long-term memory.
@@ -130,86 +385,111 @@ class AgentWithLongTermMemory:
             api_key: Google Gemini API key
             storage_path: Path to memory storage file
             user_id: Current user ID
+            semantic_cache: Reuse answers for near-duplicate questions asked
+                without recent history
         """
         self.api_key = api_key or os.getenv("GOOGLE_API_KEY")
         if not self.api_key:
             raise ValueError("GOOGLE_API_KEY environment variable required")
         
-        genai.configure(api_key=self.api_key)
-        self.model = genai.GenerativeModel('gemini-pro')
+        # The SDK is imported and the model built on the first chat() call,
+        # so code that only needs LongTermMemory never pays for them
+        self.model = None
         
         # Initialize long-term memory
         self.memory = LongTermMemory(storage_path=storage_path)
         self.user_id = user_id
+        
+        # Answers keyed by user and prompt, plus an optional embedding-based
+        # layer for paraphrased questions asked without history
+        self._exact_cache: Dict[str, str] = {}
+        self.semantic_cache = SemanticCache(self.memory.db_path) if semantic_cache else None
     
     def _extract_preference(self, message: str) -> Optional[tuple[str, Any]]:
         """Extract preference information from message."""
-        message_lower = message.lower()
-        
         # Simple pattern matching (in production, use more sophisticated NLP)
-        if "i like" in message_lower or "i prefer" in message_lower or "my favorite" in message_lower:
-            # Extract preference
-            if "programming" in message_lower or "language" in message_lower:
-                if "python" in message_lower:
-                    return ("favorite_language", "Python")
-                elif "javascript" in message_lower:
-                    return ("favorite_language", "JavaScript")
-            elif "color" in message_lower:
-                colors = ["red", "blue", "green", "yellow", "purple", "orange"]
-                for color in colors:
-                    if color in message_lower:
-                        return ("favorite_color", color)
+        if _PREF_TRIGGER_RE.search(message):
+            found = {match.group(1).lower() for match in _PREF_VALUE_RE.finditer(message)}
+            for candidate, (key, value, context_re) in _PREF_VALUES.items():
+                if candidate in found and context_re.search(message):
+                    return (key, value)
         
         return None
     
     def chat(self, message: str) -> str:
         """Process a message with long-term memory context."""
+        if self.model is None:
+            self.model = _get_model(self.api_key)
+        
+        # One timestamp for every memory update made during this turn
+        now = datetime.now().isoformat()
+        
         # Check for preference updates
         preference = self._extract_preference(message)
         if preference:
             key, value = preference
-            self.memory.save_user_preference(self.user_id, key, value)
+            self.memory.save_user_preference(self.user_id, key, value, ts=now)
             print(f"💾 Saved preference: {key} = {value}")
         
-        # Get user preferences
+        # Get user preferences once for the whole turn (a read-only lookup)
         preferences = self.memory.get_user_preferences(self.user_id)
         
         # Get recent conversation history
         history = self.memory.get_user_history(self.user_id, limit=3)
         
-        # Build context
-        context_parts = []
-        
-        if preferences:
-            prefs_str = ", ".join([f"{k}: {v}" for k, v in preferences.items()])
-            context_parts.append(f"User preferences: {prefs_str}")
-        
-        if history:
-            context_parts.append("\nRecent conversation history:")
-            for conv in history:
-                context_parts.append(f"  User: {conv['query']}")
-                context_parts.append(f"  Assistant: {conv['response']}")
-        
-        context = "\n".join(context_parts)
-        
-        # Build prompt
-        if context:
-            prompt = f"""You are a helpful AI assistant with memory of user preferences and past conversations.
-
-{context}
-
-Now respond to the user's message: {message}
-
-Use the context to provide personalized responses."""
+        # Build the prompt from fragments and join it once at the end
+        if preferences or history:
+            parts = ["You are a helpful AI assistant with memory of user preferences and past conversations.\n\n"]
+            
+            if preferences:
+                parts.append(f"User preferences: {self.memory.get_preferences_str(self.user_id)}\n")
+            
+            if history:
+                parts.append("\nRecent conversation history:\n")
+                for conv in history:
+                    parts.append(f"  User: {conv['query']}\n")
+                    parts.append(f"  Assistant: {conv['response']}\n")
+            
+            parts.append(
+                f"\nNow respond to the user's message: {message}\n\n"
+                "Use the context to provide personalized responses."
+            )
+            prompt = "".join(parts)
         else:
             prompt = message
         
+        # The exact tier keys on the full prompt, so an answer is only reused
+        # for the same user, preferences and history. The semantic tier
+        # matches on the message alone, so it is scoped to the user and their
+        # preferences and skipped once the prompt depends on history
+        scope = f"{self.user_id}|{sorted(preferences.items())}"
+        prompt_key = hashlib.sha1(f"{self.user_id}|{prompt}".encode()).hexdigest()
+        response_text = self._exact_cache.get(prompt_key)
+        
+        embedding = None
+        if response_text is None and self.semantic_cache and not history:
+            try:
+                embedding = self.semantic_cache.embed(message)
+                response_text = self.semantic_cache.lookup(scope, embedding)
+            except Exception as e:
+                print(f"Semantic cache error: {e}")
+        
         try:
-            response = self.model.generate_content(prompt)
-            response_text = response.text
+            if response_text is None:
+                response = self.model.generate_content(prompt)
+                response_text = response.text
+                
+                self._exact_cache[prompt_key] = response_text
+                if len(self._exact_cache) > 512:
+                    del self._exact_cache[next(iter(self._exact_cache))]
+                if embedding is not None:
+                    self.semantic_cache.add(scope, embedding, response_text)
             
             # Save conversation to long-term memory
-            self.memory.add_conversation(self.user_id, message, response_text)
+            self.memory.add_conversation(self.user_id, message, response_text, ts=now)
+            
+            # Persist this turn's updates in a single write
+            self.memory.flush()
             
             return response_text
         
@@ -251,6 +531,7 @@ def main():
         print("✓ Agent initialized successfully")
         print("✓ Long-term memory enabled")
         print(f"✓ Storage: {agent.memory.storage_path}")
+        print(f"✓ Conversations: {agent.memory.db_path}")
         print()
     except ValueError as e:
         print(f"✗ Error: {e}")
@@ -7,7 +7,9 @@ within a session (short-term memory).
 
 import os
 import google.generativeai as genai
-from typing import Optional, List, Dict
+from collections import deque
+from itertools import islice
+from typing import Optional, Dict, Deque
 from datetime import datetime
 
 
@@ -22,42 +24,40 @@ class ShortTermMemory:
             max_history: Maximum number of conversation turns to keep
         """
         self.max_history = max_history
-        self.conversation_history: List[Dict[str, str]] = []
+        # Bounded to the most recent messages (*2 for user+assistant pairs)
+        self.conversation_history: Deque[Dict[str, str]] = deque(maxlen=max_history * 2)
+        
+        # "Role: content" lines kept in step with conversation_history, and
+        # joined contexts reused until the next message arrives
+        self._formatted_lines: Deque[str] = deque(maxlen=max_history * 2)
+        self._context_cache: Dict[int, str] = {}
     
-    def add_message(self, role: str, content: str):
+    def add_message(self, role: str, content: str, timestamp: Optional[str] = None):
         """
         Add a message to conversation history.
         
         Args:
             role: 'user' or 'assistant'
             content: Message content
+            timestamp: ISO timestamp to record (default: now)
         """
         self.conversation_history.append({
             "role": role,
             "content": content,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": timestamp or datetime.now().isoformat()
         })
-        
-        # Keep only the most recent messages
-        if len(self.conversation_history) > self.max_history * 2:  # *2 for user+assistant pairs
-            self.conversation_history = self.conversation_history[-self.max_history * 2:]
+        self._formatted_lines.append(f"{role.capitalize()}: {content}")
+        self._context_cache.clear()
     
     def get_context(self) -> str:
         """Get formatted conversation context."""
-        if not self.conversation_history:
-            return ""
-        
-        context_parts = []
-        for msg in self.conversation_history:
-            role = msg["role"].capitalize()
-            content = msg["content"]
-            context_parts.append(f"{role}: {content}")
-        
-        return "\n".join(context_parts)
+        return self.get_recent_context(num_turns=self.max_history)
     
     def clear(self):
         """Clear conversation history."""
-        self.conversation_history = []
+        self.conversation_history.clear()
+        self._formatted_lines.clear()
+        self._context_cache.clear()
     
     def get_recent_context(self, num_turns: int = 3) -> str:
         """
@@ -66,17 +66,13 @@ class ShortTermMemory:
         Args:
             num_turns: Number of recent turns to include
         """
-        if not self.conversation_history:
-            return ""
-        
-        recent = self.conversation_history[-num_turns * 2:]  # *2 for user+assistant pairs
-        context_parts = []
-        for msg in recent:
-            role = msg["role"].capitalize()
-            content = msg["content"]
-            context_parts.append(f"{role}: {content}")
-        
-        return "\n".join(context_parts)
+        context = self._context_cache.get(num_turns)
+        if context is None:
+            # *2 for user+assistant pairs
+            start = max(len(self._formatted_lines) - num_turns * 2, 0)
+            context = "\n".join(islice(self._formatted_lines, start, None))
+            self._context_cache[num_turns] = context
+        return context
 
 
 class AgentWithShortTermMemory:
@@ -110,8 +106,11 @@ class AgentWithShortTermMemory:
         Returns:
             Agent's response
         """
+        # Both messages of this turn share one timestamp
+        now = datetime.now().isoformat()
+        
         # Add user message to history
-        self.memory.add_message("user", message)
+        self.memory.add_message("user", message, now)
         
         # Get conversation context
         context = self.memory.get_recent_context(num_turns=5)
@@ -133,20 +132,20 @@ Provide a helpful response that takes into account the conversation context."""
             response_text = response.text
             
             # Add assistant response to history
-            self.memory.add_message("assistant", response_text)
+            self.memory.add_message("assistant", response_text, now)
             
             return response_text
         
         except Exception as e:
             error_msg = f"Error: {str(e)}"
-            self.memory.add_message("assistant", error_msg)
+            self.memory.add_message("assistant", error_msg, now)
             return error_msg
     
     def get_conversation_summary(self) -> Dict:
         """Get a summary of the conversation."""
         return {
             "total_turns": len(self.memory.conversation_history) // 2,
-            "history": self.memory.conversation_history.copy()
+            "history": list(self.memory.conversation_history)
         }
     
     def clear_memory(self):
@@ -9,9 +9,37 @@ import os
 import json
 import logging
 import sys
+import secrets
+import time
 from typing import Optional, Dict, Any
-from datetime import datetime
-import uuid
+
+try:
+    import orjson
+except ImportError:  # optional: falls back to the stdlib encoder
+    orjson = None
+
+# Standard LogRecord attributes that are not part of the structured payload
+_SKIP = frozenset({
+    "name", "msg", "args", "created", "filename", "funcName",
+    "levelname", "levelno", "lineno", "module", "msecs",
+    "message", "pathname", "process", "processName", "relativeCreated",
+    "thread", "threadName", "exc_info", "exc_text", "stack_info", "taskName",
+})
+
+# Models shared by every agent, keyed by (api_key, model name)
+_MODEL_CACHE: Dict[tuple[str, str], Any] = {}
+
+
+def _get_model(api_key: str, model_name: str = "gemini-pro"):
+    """Configure the SDK and build a model once per key and model name."""
+    key = (api_key, model_name)
+    model = _MODEL_CACHE.get(key)
+    if model is None:
+        import google.generativeai as genai
+        
+        genai.configure(api_key=api_key)
+        model = _MODEL_CACHE[key] = genai.GenerativeModel(model_name)
+    return model
 
 
 class StructuredLogger:
@@ -28,21 +56,21 @@ class StructuredLogger:
         self.logger = logging.getLogger(name)
         self.logger.setLevel(getattr(logging, log_level.upper()))
         
-        # Create console handler with JSON formatter
-        handler = logging.StreamHandler(sys.stdout)
-        handler.setFormatter(StructuredFormatter())
-        self.logger.addHandler(handler)
+        # Create console handler with JSON formatter, once per named logger
+        # so loggers shared between instances don't emit every line twice
+        if not self.logger.handlers:
+            handler = logging.StreamHandler(sys.stdout)
+            handler.setFormatter(_FORMATTER)
+            self.logger.addHandler(handler)
         
         # Prevent duplicate logs
         self.logger.propagate = False
     
     def _log(self, level: str, message: str, **kwargs):
         """Internal logging method with structured data."""
-        extra = {
-            "timestamp": datetime.utcnow().isoformat(),
-            **kwargs
-        }
-        getattr(self.logger, level.lower())(message, extra=extra)
+        # kwargs is already a fresh dict per call; carried as one attribute
+        # so the formatter need not scan the record
+        getattr(self.logger, level.lower())(message, extra={"_structured": kwargs})
     
     def debug(self, message: str, **kwargs):
         """Log debug message."""
@@ -70,6 +98,7 @@ class StructuredFormatter(logging.Formatter):
     
     def format(self, record: logging.LogRecord) -> str:
         """Format log record as JSON."""
+        # record.created (epoch seconds) is the single source of the timestamp
         log_data = {
             "timestamp": record.created,
             "level": record.levelname,
@@ -77,15 +106,21 @@ class StructuredFormatter(logging.Formatter):
             "message": record.getMessage(),
         }
         
-        # Add any extra fields
-        for key, value in record.__dict__.items():
-            if key not in ["name", "msg", "args", "created", "filename", "funcName",
-                          "levelname", "levelno", "lineno", "module", "msecs",
-                          "message", "pathname", "process", "processName", "relativeCreated",
-                          "thread", "threadName", "exc_info", "exc_text", "stack_info"]:
-                log_data[key] = value
+        # Add any extra fields; records not logged through StructuredLogger
+        # fall back to scanning the record's attributes
+        structured = getattr(record, "_structured", None)
+        if structured is not None:
+            log_data.update(structured)
+        else:
+            log_data.update({k: v for k, v in record.__dict__.items() if k not in _SKIP})
         
-        return json.dumps(log_data)
+        if orjson is not None:
+            return orjson.dumps(log_data, default=str).decode()
+        return json.dumps(log_data, default=str)
+
+
+# The formatter holds no state, so every handler shares one instance
+_FORMATTER = StructuredFormatter()
 
 
 class AgentWithLogging:
@@ -93,22 +128,19 @@ class AgentWithLogging:
     
     def __init__(self, api_key: Optional[str] = None):
         """Initialize agent with logging."""
-        import google.generativeai as genai
-        
         self.api_key = api_key or os.getenv("GOOGLE_API_KEY")
         if not self.api_key:
             raise ValueError("GOOGLE_API_KEY environment variable required")
         
-        genai.configure(api_key=self.api_key)
-        self.model = genai.GenerativeModel('gemini-pro')
+        self.model = _get_model(self.api_key)
         
         # Initialize logger
         self.logger = StructuredLogger(name="agent", log_level="INFO")
         self.request_id = None
     
     def _generate_request_id(self) -> str:
-        """Generate a unique request ID."""
-        return str(uuid.uuid4())
+        """Generate a unique request ID (128 random bits as hex)."""
+        return secrets.token_hex(16)
     
     def chat(self, message: str, user_id: Optional[str] = None) -> str:
         """
@@ -141,11 +173,9 @@ class AgentWithLogging:
                 model="gemini-pro"
             )
             
-            start_time = datetime.utcnow()
+            start_time = time.perf_counter()
             response = self.model.generate_content(message)
-            end_time = datetime.utcnow()
-            
-            response_time = (end_time - start_time).total_seconds()
+            response_time = time.perf_counter() - start_time
             response_text = response.text
             
             # Log successful response
@@ -8,11 +8,152 @@ tracing, and metrics collection.
 import os
 import json
 import time
-import google.generativeai as genai
-from typing import Optional, Dict, Any, List
+import hashlib
+from typing import Optional, Dict, Any, List, Deque, Iterator, NamedTuple
+from types import MappingProxyType
 from datetime import datetime
-from collections import defaultdict
-import uuid
+from array import array
+from collections import Counter, deque
+from itertools import count, islice
+import secrets
+import zlib
+
+try:
+    import orjson
+except ImportError:  # optional: falls back to the stdlib encoder
+    orjson = None
+
+# IDs only need to be unique within this process: a random per-process salt
+# plus a counter avoids reading os.urandom for every request and span
+_ID_SALT = secrets.token_hex(8)
+_ID_COUNTER = count()
+
+
+# Preset dictionary for compressing exported traces: the keys and values
+# every span repeats, so even a small batch compresses well. zlib favours
+# the end of the dictionary, so the most common fragments come last.
+# Changing it makes previously exported blobs unreadable.
+_TRACE_ZDICT = (
+    b'{"message":"Error occurred","error":"error_type":"success":false,'
+    b'"model":"gemini-pro"},{"message":"LLM call completed","tokens":'
+    b'"logs":[{"message":"Calling LLM","timestamp":"2'
+    b'"response_length":"response_time_seconds":'
+    b'"user_id":"anonymous","message_length":"success":true,'
+    b'"duration_seconds":"tags":{"request_id":"'
+    b'[{"trace_id":"","spans":[{"span_id":"","parent_id":null,'
+    b'"name":"agent.chat","start_time":"end_time":'
+)
+
+
+def decompress_traces(blob: bytes) -> List[Dict[str, Any]]:
+    """Decode a batch produced by Tracer.export_compressed."""
+    decompressor = zlib.decompressobj(zdict=_TRACE_ZDICT)
+    data = decompressor.decompress(blob) + decompressor.flush()
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def _fast_id() -> str:
+    """Generate a process-unique ID."""
+    return f"{_ID_SALT}-{next(_ID_COUNTER):x}"
+
+
+# Models shared by every agent, keyed by a digest of the API key (so the
+# raw key is not kept as a dict key) and the model name
+_MODEL_CACHE: Dict[tuple[str, str], Any] = {}
+
+
+def _get_model(api_key: str, model_name: str = "gemini-pro"):
+    """Configure the SDK and build a model once per key and model name."""
+    key = (hashlib.blake2b(api_key.encode(), digest_size=8).hexdigest(), model_name)
+    model = _MODEL_CACHE.get(key)
+    if model is None:
+        # Imported on first use so metrics/tracing-only code skips the SDK
+        import google.generativeai as genai
+        
+        genai.configure(api_key=api_key)
+        model = _MODEL_CACHE[key] = genai.GenerativeModel(model_name)
+    return model
+
+
+def _approx_tokens(text: str) -> int:
+    """Rough token count: spaces + 1, counted in C without building a list."""
+    return text.count(" ") + 1 if text else 0
+
+
+class P2Quantile:
+    """
+    Streaming quantile estimate using the P² algorithm (Jain & Chlamtac).
+    
+    Keeps five markers instead of every observation, so memory and the
+    cost of reading the estimate are constant however many values arrive.
+    """
+    
+    def __init__(self, quantile: float):
+        """
+        Initialize the estimator.
+        
+        Args:
+            quantile: Target quantile between 0 and 1 (e.g. 0.95)
+        """
+        self.p = quantile
+        self.count = 0
+        self._heights: List[float] = []
+        self._positions = [0, 1, 2, 3, 4]
+        self._desired = [0.0, 2 * quantile, 4 * quantile, 2 + 2 * quantile, 4.0]
+        self._increments = [0.0, quantile / 2, quantile, (1 + quantile) / 2, 1.0]
+    
+    def update(self, value: float):
+        """Add an observation."""
+        self.count += 1
+        q = self._heights
+        if self.count <= 5:
+            q.append(value)
+            q.sort()
+            return
+        
+        # Find the cell the value falls in, widening the extremes if needed
+        if value < q[0]:
+            q[0] = value
+            k = 0
+        elif value >= q[4]:
+            q[4] = value
+            k = 3
+        else:
+            k = 0
+            while value >= q[k + 1]:
+                k += 1
+        
+        n = self._positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self._desired[i] += self._increments[i]
+        
+        # Nudge the three middle markers toward their desired positions
+        for i in (1, 2, 3):
+            d = self._desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+    
+    def value(self) -> float:
+        """Current estimate (exact, interpolated, until five values are seen)."""
+        q = self._heights
+        if not q:
+            return 0.0
+        if self.count > 5:
+            return q[2]
+        position = (len(q) - 1) * self.p
+        lower = int(position)
+        upper = min(lower + 1, len(q) - 1)
+        return q[lower] + (q[upper] - q[lower]) * (position - lower)
 
 
 class MetricsCollector:
@@ -26,23 +167,27 @@ class MetricsCollector:
             "requests_error": 0,
             "total_response_time": 0.0,
             "total_tokens": 0,
-            "errors_by_type": defaultdict(int),
         }
-        self.request_times: List[float] = []
+        # Error counts per exception type, kept apart from the scalar totals
+        self._errors: Counter = Counter()
+        # Streaming percentile sketches instead of every response time
+        self._p50 = P2Quantile(0.5)
+        self._p95 = P2Quantile(0.95)
     
     def record_request(self, success: bool, response_time: float, tokens: int = 0, error_type: Optional[str] = None):
         """Record a request metric."""
         self.metrics["requests_total"] += 1
         self.metrics["total_response_time"] += response_time
         self.metrics["total_tokens"] += tokens
-        self.request_times.append(response_time)
+        self._p50.update(response_time)
+        self._p95.update(response_time)
         
         if success:
             self.metrics["requests_success"] += 1
         else:
             self.metrics["requests_error"] += 1
             if error_type:
-                self.metrics["errors_by_type"][error_type] += 1
+                self._errors[error_type] += 1
     
     def get_stats(self) -> Dict[str, Any]:
         """Get aggregated statistics."""
@@ -53,9 +198,8 @@ class MetricsCollector:
         avg_response_time = self.metrics["total_response_time"] / total
         success_rate = (self.metrics["requests_success"] / total) * 100
         
-        sorted_times = sorted(self.request_times)
-        p50 = sorted_times[len(sorted_times) // 2] if sorted_times else 0
-        p95 = sorted_times[int(len(sorted_times) * 0.95)] if sorted_times else 0
+        p50 = self._p50.value()
+        p95 = self._p95.value()
         
         return {
             "total_requests": total,
@@ -65,44 +209,56 @@ class MetricsCollector:
             "p50_response_time_seconds": f"{p50:.3f}",
             "p95_response_time_seconds": f"{p95:.3f}",
             "total_tokens": self.metrics["total_tokens"],
-            "errors_by_type": dict(self.metrics["errors_by_type"])
+            "errors_by_type": dict(self._errors.most_common())
         }
 
 
 class TraceSpan:
     """Represents a span in a trace."""
     
+    # One span per request: skip the per-instance __dict__
+    __slots__ = ("span_id", "parent_id", "name", "start_time", "_start_ns", "_end_ns", "tags", "logs")
+    
     def __init__(self, name: str, parent_id: Optional[str] = None):
         """Initialize a trace span."""
-        self.span_id = str(uuid.uuid4())
+        self.span_id = _fast_id()
         self.parent_id = parent_id
         self.name = name
+        # Wall-clock start for display; durations use the monotonic clock
+        # (integer nanoseconds, immune to wall-clock adjustments)
         self.start_time = time.time()
-        self.end_time = None
+        self._start_ns = time.monotonic_ns()
+        self._end_ns: Optional[int] = None
         self.tags: Dict[str, Any] = {}
         self.logs: List[Dict[str, Any]] = []
     
     def finish(self):
         """Finish the span."""
-        self.end_time = time.time()
+        self._end_ns = time.monotonic_ns()
+    
+    @property
+    def end_time(self) -> Optional[float]:
+        """Wall-clock end time (None until the span is finished)."""
+        if self._end_ns is None:
+            return None
+        return self.start_time + (self._end_ns - self._start_ns) / 1e9
     
     def add_tag(self, key: str, value: Any):
         """Add a tag to the span."""
         self.tags[key] = value
     
     def add_log(self, message: str, **kwargs):
-        """Add a log entry to the span."""
+        """Add a log entry to the span (timestamped as epoch seconds)."""
         self.logs.append({
             "message": message,
-            "timestamp": datetime.utcnow().isoformat(),
+            "timestamp": time.time(),
             **kwargs
         })
     
     def duration(self) -> float:
         """Get span duration in seconds."""
-        if self.end_time:
-            return self.end_time - self.start_time
-        return time.time() - self.start_time
+        end_ns = self._end_ns if self._end_ns is not None else time.monotonic_ns()
+        return (end_ns - self._start_ns) / 1e9
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert span to dictionary."""
@@ -113,17 +269,28 @@ class TraceSpan:
             "start_time": self.start_time,
             "end_time": self.end_time,
             "duration_seconds": self.duration(),
-            "tags": self.tags,
-            "logs": self.logs
+            "tags": dict(self.tags),
+            "logs": [
+                {**log, "timestamp": datetime.utcfromtimestamp(log["timestamp"]).isoformat()}
+                for log in self.logs
+            ]
         }
 
 
+class StoredTrace(NamedTuple):
+    """A finished trace as kept by the Tracer (serialized when reported)."""
+    trace_id: str
+    span: TraceSpan
+    timestamp: float
+
+
 class Tracer:
     """Distributed tracing for agent operations."""
     
     def __init__(self):
         """Initialize tracer."""
-        self.traces: List[Dict[str, Any]] = []
+        # Ring buffer of the most recent traces; older ones are evicted
+        self.traces: Deque[StoredTrace] = deque(maxlen=int(os.getenv("TRACE_RING", "10000")))
     
     def start_trace(self, operation: str, request_id: str) -> TraceSpan:
         """Start a new trace."""
@@ -131,20 +298,84 @@ class Tracer:
         span.add_tag("request_id", request_id)
         return span
     
-    def finish_trace(self, span: TraceSpan, trace_id: Optional[str] = None):
-        """Finish a trace and store it."""
+    def finish_trace(self, span: TraceSpan, trace_id: Optional[str] = None) -> StoredTrace:
+        """Finish a trace and store it (spans are converted when reported)."""
         span.finish()
-        trace = {
-            "trace_id": trace_id or str(uuid.uuid4()),
-            "spans": [span.to_dict()],
-            "timestamp": datetime.utcnow().isoformat()
-        }
+        # Freeze the tags so later changes can't alter the stored trace
+        span.tags = MappingProxyType(span.tags)
+        trace = StoredTrace(trace_id or _fast_id(), span, time.time())
         self.traces.append(trace)
         return trace
     
+    @staticmethod
+    def _trace_to_dict(trace: StoredTrace) -> Dict[str, Any]:
+        """Materialize a stored trace into plain, serializable values."""
+        return {
+            "trace_id": trace.trace_id,
+            "spans": [trace.span.to_dict()],
+            "timestamp": datetime.utcfromtimestamp(trace.timestamp).isoformat()
+        }
+    
     def get_recent_traces(self, limit: int = 10) -> List[Dict[str, Any]]:
         """Get recent traces."""
-        return self.traces[-limit:]
+        # Walk back from the newest entry so only `limit` items are visited
+        recent = [self._trace_to_dict(trace) for trace in islice(reversed(self.traces), limit)]
+        recent.reverse()
+        return recent
+    
+    def export_json(self, limit: Optional[int] = None) -> bytes:
+        """
+        Serialize recent traces as one JSON batch.
+        
+        Args:
+            limit: Number of most recent traces to include (default: all)
+            
+        Returns:
+            UTF-8 encoded JSON array of traces
+        """
+        traces = self.get_recent_traces(len(self.traces) if limit is None else limit)
+        if orjson is not None:
+            return orjson.dumps(traces)
+        return json.dumps(traces, separators=(",", ":")).encode()
+    
+    def export_compressed(self, limit: Optional[int] = None, level: int = 6) -> bytes:
+        """
+        Serialize recent traces as one JSON batch compressed with zlib.
+        
+        Args:
+            limit: Number of most recent traces to include (default: all)
+            level: zlib compression level (1-9)
+            
+        Returns:
+            Compressed batch; read it back with decompress_traces()
+        """
+        compressor = zlib.compressobj(level, zdict=_TRACE_ZDICT)
+        return compressor.compress(self.export_json(limit)) + compressor.flush()
+    
+    def export_columnar(self, batch_size: int = 1024) -> Iterator[Dict[str, Any]]:
+        """
+        Export spans column by column, for columnar analytics sinks.
+        
+        Args:
+            batch_size: Maximum number of spans per batch
+            
+        Yields:
+            One dict of equal-length columns per batch: numeric columns are
+            packed arrays of doubles, string columns are lists, and each tag
+            key gets its own column (None where a span lacks the tag)
+        """
+        spans = [(trace.trace_id, trace.span) for trace in self.traces]
+        for offset in range(0, len(spans), batch_size):
+            batch = spans[offset:offset + batch_size]
+            tag_keys = list(dict.fromkeys(key for _, span in batch for key in span.tags))
+            yield {
+                "trace_id": [trace_id for trace_id, _ in batch],
+                "span_id": [span.span_id for _, span in batch],
+                "name": [span.name for _, span in batch],
+                "start_time": array("d", (span.start_time for _, span in batch)),
+                "duration_seconds": array("d", (span.duration() for _, span in batch)),
+                "tags": {key: [span.tags.get(key) for _, span in batch] for key in tag_keys},
+            }
 
 
 class ObservableAgent:
@@ -156,8 +387,7 @@ class ObservableAgent:
         if not self.api_key:
             raise ValueError("GOOGLE_API_KEY environment variable required")
         
-        genai.configure(api_key=self.api_key)
-        self.model = genai.GenerativeModel('gemini-pro')
+        self.model = _get_model(self.api_key)
         
         # Initialize observability components
         self.metrics = MetricsCollector()
@@ -166,7 +396,7 @@ class ObservableAgent:
     
     def _generate_request_id(self) -> str:
         """Generate unique request ID."""
-        return str(uuid.uuid4())
+        return _fast_id()
     
     def chat(self, message: str, user_id: Optional[str] = None) -> str:
         """Process message with full observability."""
@@ -188,8 +418,10 @@ class ObservableAgent:
             response_time = end_time - start_time
             response_text = response.text
             
-            # Estimate tokens (rough approximation)
-            estimated_tokens = len(message.split()) + len(response_text.split())
+            # Measure the response once and reuse it for metrics and tags;
+            # tokens are a rough approximation
+            response_length = len(response_text)
+            estimated_tokens = _approx_tokens(message) + _approx_tokens(response_text)
             
             # Record metrics
             self.metrics.record_request(
@@ -200,7 +432,7 @@ class ObservableAgent:
             
             # Finish trace
             trace_span.add_tag("success", True)
-            trace_span.add_tag("response_length", len(response_text))
+            trace_span.add_tag("response_length", response_length)
             trace_span.add_tag("response_time_seconds", response_time)
             trace_span.add_log("LLM call completed", tokens=estimated_tokens)
             
@@ -287,7 +519,10 @@ def main():
     
     report = agent.get_observability_report()
     print("Metrics:")
-    print(json.dumps(report["metrics"], indent=2))
+    if orjson is not None:
+        print(orjson.dumps(report["metrics"], option=orjson.OPT_INDENT_2).decode())
+    else:
+        print(json.dumps(report["metrics"], indent=2))
     print()
     print(f"Recent Traces: {len(report['recent_traces'])}")
     print()
@@ -6,12 +6,56 @@ communication, and task delegation.
 """
 
 import os
-import google.generativeai as genai
-from typing import Optional, Dict, Any, List
+import sys
+import hashlib
+import threading
+from typing import Optional, Dict, Any, List, Iterator, Deque
 from enum import Enum
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import cycle
 import json
 
 
+# Models shared by every agent, keyed by a digest of the API key (so the
+# raw key is not kept as a dict key) and the model name
+_MODEL_CACHE: Dict[tuple[str, str], Any] = {}
+
+
+def _get_model(api_key: str, model_name: str = "gemini-pro"):
+    """Configure the SDK and build a model once per key and model name."""
+    key = (hashlib.blake2b(api_key.encode(), digest_size=8).hexdigest(), model_name)
+    model = _MODEL_CACHE.get(key)
+    if model is None:
+        # Imported on first use so code that only needs the message and
+        # role types never loads the SDK
+        import google.generativeai as genai
+        
+        genai.configure(api_key=api_key)
+        model = _MODEL_CACHE[key] = genai.GenerativeModel(model_name)
+    return model
+
+
+# Prompt skeletons for the worker agents, filled with format_map per task
+_RESEARCH_PROMPT = sys.intern("""You are a research agent. Research and provide information about:
+
+{content}
+
+Provide a comprehensive research summary.""")
+
+_ANALYSIS_PROMPT = sys.intern("""You are an analysis agent. Analyze and provide insights about:
+
+{content}
+
+Provide detailed analysis and key findings.""")
+
+_WRITING_PROMPT = sys.intern("""You are a writing agent. Create well-written content about:
+
+{content}
+
+Provide clear, engaging written content.""")
+
+
 class AgentRole(Enum):
     """Agent roles in the multi-agent system."""
     COORDINATOR = "coordinator"
@@ -23,6 +67,9 @@ class AgentRole(Enum):
 class AgentMessage:
     """Message structure for agent-to-agent communication."""
     
+    # Several messages per coordinated task: skip the per-instance __dict__
+    __slots__ = ("from_agent", "to_agent", "content", "message_type", "timestamp")
+    
     def __init__(self, from_agent: str, to_agent: str, content: str, message_type: str = "task"):
         """
         Initialize agent message.
@@ -52,6 +99,8 @@ class AgentMessage:
 class BaseAgent:
     """Base class for agents in the multi-agent system."""
     
+    INBOX_SIZE = 1024
+    
     def __init__(self, name: str, role: AgentRole, api_key: Optional[str] = None):
         """
         Initialize base agent.
@@ -68,15 +117,40 @@ class BaseAgent:
         if not self.api_key:
             raise ValueError("GOOGLE_API_KEY environment variable required")
         
-        genai.configure(api_key=self.api_key)
-        self.model = genai.GenerativeModel('gemini-pro')
+        self.model = _get_model(self.api_key)
         
-        self.inbox: List[AgentMessage] = []
+        # Pending messages, consumed in arrival order; the oldest is dropped
+        # (with a warning) if the agent falls INBOX_SIZE messages behind.
+        # inbox_lock guards only the deque operations, never an LLM call
+        self.inbox: Deque[AgentMessage] = deque(maxlen=self.INBOX_SIZE)
+        self.inbox_lock = threading.Lock()
         self.capabilities = []
     
     def receive_message(self, message: AgentMessage):
         """Receive a message from another agent."""
-        self.inbox.append(message)
+        with self.inbox_lock:
+            if len(self.inbox) == self.inbox.maxlen:
+                dropped = self.inbox[0]
+                print(f"Warning: {self.name} inbox full, dropping message from {dropped.from_agent}")
+            self.inbox.append(message)
+    
+    def process_next(self) -> Optional[AgentMessage]:
+        """Take the oldest message from the inbox and process it."""
+        with self.inbox_lock:
+            if not self.inbox:
+                return None
+            message = self.inbox.popleft()
+        return self.process_message(message)
+    
+    def process_received(self, message: AgentMessage) -> Optional[AgentMessage]:
+        """Take a specific message out of the inbox and process it."""
+        with self.inbox_lock:
+            try:
+                self.inbox.remove(message)
+            except ValueError:
+                # Already consumed by process_next, or dropped from a full inbox
+                return None
+        return self.process_message(message)
     
     def process_message(self, message: AgentMessage) -> Optional[AgentMessage]:
         """Process a received message and optionally respond."""
@@ -108,30 +182,36 @@ class CoordinatorAgent(BaseAgent):
         super().__init__("Coordinator", AgentRole.COORDINATOR, api_key)
         self.capabilities = ["coordination", "task_delegation", "result_aggregation"]
         self.agents: Dict[str, BaseAgent] = {}
+        # Role index for O(1) dispatch; agents sharing a role take turns
+        self.agents_by_role: Dict[AgentRole, List[BaseAgent]] = {}
+        self._role_cycles: Dict[AgentRole, Iterator[BaseAgent]] = {}
     
     def register_agent(self, agent: BaseAgent):
         """Register an agent in the system."""
         self.agents[agent.name] = agent
+        role_agents = self.agents_by_role.setdefault(agent.role, [])
+        role_agents.append(agent)
+        self._role_cycles[agent.role] = cycle(role_agents)
         print(f"✓ Registered agent: {agent.name} ({agent.role.value})")
     
     def delegate_task(self, task: str, target_role: AgentRole) -> Optional[str]:
         """Delegate a task to an agent with specific role."""
-        # Find agent with target role
-        target_agent = None
-        for agent in self.agents.values():
-            if agent.role == target_role:
-                target_agent = agent
-                break
+        # Pick the next agent with the target role (round-robin)
+        role_cycle = self._role_cycles.get(target_role)
+        target_agent = next(role_cycle) if role_cycle else None
         
         if not target_agent:
             return f"No agent available with role: {target_role.value}"
         
-        # Create and send task message
-        message = self.send_message(target_agent.name, task, message_type="task")
-        target_agent.receive_message(message)
-        
-        # Process the message
-        response = target_agent.process_message(message)
+        return self._deliver(target_agent, task)
+    
+    def _deliver(self, agent: BaseAgent, task: str) -> str:
+        """Send a task to a specific agent and return its response."""
+        # Create and send task message, then have the agent consume that
+        # message, whatever else is waiting in its inbox
+        message = self.send_message(agent.name, task, message_type="task")
+        agent.receive_message(message)
+        response = agent.process_received(message)
         
         if response:
             return response.content
@@ -147,16 +227,23 @@ Available agents: {[agent.name for agent in self.agents.values()]}
 
 Provide a coordination plan in JSON format with steps and agent assignments."""
         
-        plan = self.think(prompt)
+        # Simple execution (in production, parse plan and execute). The
+        # agents work independently and each call waits on the network,
+        # so run them concurrently: total latency is the slowest call.
+        # The plan doesn't drive execution yet, so it is requested
+        # alongside the delegated calls instead of before them. Each worker
+        # gets the task directly, so its result is reported under its name
+        workers = [
+            agent for agent in self.agents.values()
+            if agent.role != AgentRole.COORDINATOR
+        ]
         
-        # Simple execution (in production, parse plan and execute)
-        results = []
-        for agent_name, agent in self.agents.items():
-            if agent.role != AgentRole.COORDINATOR:
-                result = self.delegate_task(task, agent.role)
-                results.append(f"{agent_name}: {result}")
+        with ThreadPoolExecutor(max_workers=len(workers) + 1) as pool:
+            plan_future = pool.submit(self.think, prompt)
+            results = list(pool.map(lambda agent: self._deliver(agent, task), workers))
+            plan = plan_future.result()
         
-        return "\n".join(results)
+        return "\n".join(f"{agent.name}: {result}" for agent, result in zip(workers, results))
     
     def process_message(self, message: AgentMessage) -> Optional[AgentMessage]:
         """Process messages received by coordinator."""
@@ -177,11 +264,7 @@ class ResearcherAgent(BaseAgent):
     def process_message(self, message: AgentMessage) -> Optional[AgentMessage]:
         """Process research tasks."""
         if message.message_type == "task":
-            prompt = f"""You are a research agent. Research and provide information about:
-
-{message.content}
-
-Provide a comprehensive research summary."""
+            prompt = _RESEARCH_PROMPT.format_map({"content": message.content})
             
             research_result = self.think(prompt)
             
@@ -204,11 +287,7 @@ class AnalyzerAgent(BaseAgent):
     def process_message(self, message: AgentMessage) -> Optional[AgentMessage]:
         """Process analysis tasks."""
         if message.message_type == "task":
-            prompt = f"""You are an analysis agent. Analyze and provide insights about:
-
-{message.content}
-
-Provide detailed analysis and key findings."""
+            prompt = _ANALYSIS_PROMPT.format_map({"content": message.content})
             
             analysis_result = self.think(prompt)
             
@@ -231,11 +310,7 @@ class WriterAgent(BaseAgent):
     def process_message(self, message: AgentMessage) -> Optional[AgentMessage]:
         """Process writing tasks."""
         if message.message_type == "task":
-            prompt = f"""You are a writing agent. Create well-written content about:
-
-{message.content}
-
-Provide clear, engaging written content."""
+            prompt = _WRITING_PROMPT.format_map({"content": message.content})
             
             writing_result = self.think(prompt)
             
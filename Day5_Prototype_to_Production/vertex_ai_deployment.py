@@ -9,6 +9,11 @@ import os
 import json
 from typing import Optional, Dict, Any
 
+try:
+    import orjson
+except ImportError:  # optional: falls back to the stdlib encoder
+    orjson = None
+
 
 class VertexAIDeployment:
     """Helper class for Vertex AI agent deployment."""
@@ -211,8 +216,13 @@ def main():
     
     # Save configuration
     config_file = "agent_config.json"
-    with open(config_file, 'w') as f:
-        json.dump(agent_config, f, indent=2)
+    if orjson is not None:
+        # Serialized in C and written with a single call
+        with open(config_file, 'wb') as f:
+            f.write(orjson.dumps(agent_config, option=orjson.OPT_INDENT_2))
+    else:
+        with open(config_file, 'w') as f:
+            json.dump(agent_config, f, indent=2)
     print(f"✓ Saved agent configuration to {config_file}")
     print()
     